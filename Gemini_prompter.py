@@ -3,9 +3,20 @@ import argparse
 import google.generativeai as genai
 from anthropic import Anthropic
 import time
+import datetime
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from VideoRag.videorag._llm import *
 from VideoRag.videorag import VideoRag, QueryParam
+from VideoRag.videorag._service import get_service
+from VideoRag.videorag._fingerprint import compute_video_fingerprint
+
+# instructional videos are uploaded once per content fingerprint and reused until shortly before Gemini expires them
+_instructional_uploads = {}
+_instructional_uploads_lock = threading.Lock()
+UPLOAD_EXPIRY_MARGIN = datetime.timedelta(hours=1)
 
 def generate_coaching_prompt_anthropic(activity, accommodations=""):
     prompt = f"Create a coaching prompt for the activity: {activity}."
@@ -70,23 +81,67 @@ def generate_coaching_prompt(model, activity, additional_info="", anthropic_prom
             fallback_prompt += f" Consider the following: {combined_info}"
         return fallback_prompt, "helpful and direct"
 
+def upload_video(video_path, poll_interval=2):
+    # upload_file streams the file from disk in chunks, so only a handle is kept in memory
+    mime_type = mimetypes.guess_type(video_path)[0] or "video/mp4"
+    video_file = genai.upload_file(path=video_path, mime_type=mime_type)
+    try:
+        while video_file.state.name == "PROCESSING":
+            time.sleep(poll_interval)
+            video_file = genai.get_file(video_file.name)
+        if video_file.state.name == "FAILED":
+            raise ValueError(f"Gemini could not process {video_path}")
+    except Exception:
+        delete_upload(video_file)
+        raise
+    return video_file
+
+def delete_upload(video_file):
+    try:
+        genai.delete_file(video_file.name)
+    except Exception as e:
+        print(f"Error deleting uploaded video {video_file.name}: {e}")
+
+def upload_instructional_video(video_path):
+    fingerprint = compute_video_fingerprint(video_path)
+    with _instructional_uploads_lock:
+        video_file = _instructional_uploads.get(fingerprint)
+    expiration_time = getattr(video_file, "expiration_time", None)
+    if video_file is not None and (
+        expiration_time is None
+        or expiration_time - datetime.datetime.now(datetime.timezone.utc) > UPLOAD_EXPIRY_MARGIN
+    ):
+        return video_file
+    video_file = upload_video(video_path)
+    with _instructional_uploads_lock:
+        _instructional_uploads[fingerprint] = video_file
+    return video_file
+
 def gemini_flash(model, instructional_videos, user_video, prompt, coaching_tone):
+    user_upload = None
     try:
-        video_paths = []
-        contents = [prompt, coaching_tone]
-        for video_path in instructional_videos + [user_video]:
-            video_paths.append(video_path)
-            with open(video_path, 'rb') as video_file:
-                contents.append({"mime_type": "video/mp4", "data": video_file.read()})
+        video_paths = instructional_videos + [user_video]
 
-        videorag = VideoRAG(provider_in_use="gemini", working_dir=f"./videorag-workdir")
-        videorag.insert_video(video_path_list=video_paths)
+        # resident instance: stores and models are loaded once per process
+        videorag = get_service(provider_in_use="gemini", working_dir=f"./videorag-workdir")
+        videorag.insert_video(video_paths)
 
         query = prompt
 
-        vrag_response = videorag.query(query=query, param=QueryParam(mode="videorag"))
+        vrag_response = videorag.query(query, QueryParam(mode="videorag"))
 
-        contents = [vrag_response + contents[0], contents[1]]
+        # all uploads run at once; only the user's video is deleted afterwards
+        with ThreadPoolExecutor(max_workers=len(video_paths)) as executor:
+            user_future = executor.submit(upload_video, user_video)
+            instructional_futures = [
+                executor.submit(upload_instructional_video, video_path)
+                for video_path in instructional_videos
+            ]
+            try:
+                user_upload = user_future.result()
+            finally:
+                uploaded_videos = [future.result() for future in instructional_futures]
+        contents = [vrag_response + prompt, coaching_tone] + uploaded_videos + [user_upload]
 
         response = model.generate_content(
             contents=contents,
@@ -97,6 +152,9 @@ def gemini_flash(model, instructional_videos, user_video, prompt, coaching_tone)
     except Exception as e:
         print(f"Error processing videos with Gemini 2.0 Flash: {e}")
         return "An error occurred while processing the videos. Please try again later."
+    finally:
+        if user_upload is not None:
+            delete_upload(user_upload)
 
 def main():
     parser = argparse.ArgumentParser(description="Process videos with Gemini 2.0 Flash for coaching.")
@@ -0,0 +1,84 @@
+import time
+import random
+import argparse
+
+from videorag._op import chunking_by_video_segments
+from videorag._tokenizer import get_tiktoken_encoder
+
+
+def reference_chunking_by_video_segments(tokens_list, doc_keys, tiktoken_model, max_token_size=1024):
+    # previous per-chunk list-copy implementation, kept to check for identical output
+    tokens_list = [tokens[:max_token_size] for tokens in tokens_list]
+    results = []
+    chunk_token = []
+    chunk_segment_ids = []
+    chunk_order_index = 0
+    for index, tokens in enumerate(tokens_list):
+        if len(chunk_token) + len(tokens) <= max_token_size:
+            chunk_token += tokens.copy()
+            chunk_segment_ids.append(doc_keys[index])
+        else:
+            results.append(
+                {
+                    "tokens": len(chunk_token),
+                    "content": tiktoken_model.decode(chunk_token).strip(),
+                    "chunk_order_index": chunk_order_index,
+                    "video_segment_id": chunk_segment_ids,
+                }
+            )
+            chunk_token = tokens.copy()
+            chunk_segment_ids = [doc_keys[index]]
+            chunk_order_index += 1
+    if len(chunk_token) > 0:
+        results.append(
+            {
+                "tokens": len(chunk_token),
+                "content": tiktoken_model.decode(chunk_token).strip(),
+                "chunk_order_index": chunk_order_index,
+                "video_segment_id": chunk_segment_ids,
+            }
+        )
+    return results
+
+
+def synthetic_transcript(encoder, hours, segment_seconds, seed):
+    # ~2.5 spoken words per second plus a caption line per segment
+    rng = random.Random(seed)
+    words = [w for w in "the worm starts in a plank then roll your chest forward and push through the hips keeping arms tight".split()]
+    n_segments = int(hours * 3600 / segment_seconds)
+    docs = [
+        "Caption: " + " ".join(rng.choices(words, k=rng.randint(20, 60)))
+        + "\nTranscript: " + " ".join(rng.choices(words, k=int(segment_seconds * rng.uniform(1.5, 3.5))))
+        for _ in range(n_segments)
+    ]
+    return encoder.encode_batch(docs), [f"video_{i}" for i in range(n_segments)]
+
+
+def bench(func, tokens_list, doc_keys, encoder, max_token_size, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(tokens_list, doc_keys, encoder, max_token_size=max_token_size)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark chunking_by_video_segments.")
+    parser.add_argument("--hours", type=float, default=10)
+    parser.add_argument("--segment-seconds", type=int, default=30)
+    parser.add_argument("--max-token-size", type=int, default=1024)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    encoder = get_tiktoken_encoder("gpt-4o")
+    tokens_list, doc_keys = synthetic_transcript(encoder, args.hours, args.segment_seconds, args.seed)
+    print(f"{len(tokens_list)} segments, {sum(map(len, tokens_list))} tokens")
+
+    ref_time, ref_result = bench(reference_chunking_by_video_segments, tokens_list, doc_keys, encoder, args.max_token_size, args.repeat)
+    new_time, new_result = bench(chunking_by_video_segments, tokens_list, doc_keys, encoder, args.max_token_size, args.repeat)
+    assert new_result == ref_result, "chunker output differs from the reference implementation"
+    print(f"{len(new_result)} chunks, identical output")
+    print(f"reference: {ref_time * 1000:.1f} ms")
+    print(f"prefix-sum: {new_time * 1000:.1f} ms ({ref_time / new_time:.2f}x)")
@@ -0,0 +1,300 @@
+import gc
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+
+import numpy as np
+
+from videorag._op import (
+    BATCH_FILTERING_SEGMENT_PROMPT,
+    BATCH_SUMMARIZE_DESCRIPTIONS_PROMPT,
+    COMBINED_QUERY_REWRITE_PROMPT,
+    extract_entities,
+    get_chunks,
+    videorag_query,
+)
+from videorag._metrics import metrics_snapshot, reset_metrics
+from videorag._storage import JsonKVStorage, NanoVectorDBStorage, NetworkXStorage
+from videorag._utils import limit_async_func_call, wrap_embedding_func_with_attrs
+from videorag.base import QueryParam
+from videorag.prompt import PROMPTS
+
+WORDS = "the worm starts in a plank then roll your chest forward and push through the hips keeping arms tight".split()
+SEGMENTS_PER_VIDEO = 120  # one hour of 30 second segments
+QUERIES = [
+    "How do I do the worm?",
+    "What should my arms do during the roll?",
+    "When do the hips push through?",
+    "How do I start from a plank?",
+    "What is the most common mistake in this move?",
+]
+
+
+def _template_prefix(template: str) -> str:
+    # the fixed text before the first placeholder identifies which prompt was sent
+    return template.split("{")[0].strip()[:80]
+
+
+class MockLLM:
+    """Deterministic stand-in for ``best_model_func`` and ``cheap_model_func``.
+
+    Every reply depends only on the prompt, the history and the seed, and each
+    call sleeps ``latency`` seconds (plus up to ``jitter``, also seeded) to stand
+    in for the provider round trip. Extraction replies name entities from a fixed
+    vocabulary so the graph grows with the corpus the way a real one does.
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, entity_vocabulary: int = 200, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.seed = seed
+        self.entities = [f"MOVE {i}" for i in range(entity_vocabulary)]
+        self.calls = 0
+        self._kinds = [
+            ("combined_rewrite", _template_prefix(COMBINED_QUERY_REWRITE_PROMPT)),
+            ("segment_filter", _template_prefix(BATCH_FILTERING_SEGMENT_PROMPT)),
+            ("batch_summary", _template_prefix(BATCH_SUMMARIZE_DESCRIPTIONS_PROMPT)),
+            ("extraction", _template_prefix(PROMPTS["entity_extraction"])),
+            ("summary", _template_prefix(PROMPTS["summarize_entity_descriptions"])),
+            ("rewrite", _template_prefix(PROMPTS["query_rewrite_for_entity_retrieval"])),
+            ("rewrite", _template_prefix(PROMPTS["query_rewrite_for_visual_retrieval"])),
+        ]
+
+    def _kind(self, prompt: str) -> str:
+        if prompt.startswith(PROMPTS["entiti_continue_extraction"]):
+            return "glean"
+        for kind, prefix in self._kinds:
+            if prefix and prompt.startswith(prefix):
+                return kind
+        return "answer"
+
+    def _records(self, rng: random.Random, n_entities: int) -> str:
+        tuple_delimiter = PROMPTS["DEFAULT_TUPLE_DELIMITER"]
+        names = rng.sample(self.entities, n_entities)
+        records = [
+            f'("entity"{tuple_delimiter}"{name}"{tuple_delimiter}"TECHNIQUE"{tuple_delimiter}"{name} is a step of the worm.")'
+            for name in names
+        ]
+        records += [
+            f'("relationship"{tuple_delimiter}"{src}"{tuple_delimiter}"{tgt}"{tuple_delimiter}"{src} leads into {tgt}."{tuple_delimiter}{rng.randint(1, 10)})'
+            for src, tgt in zip(names, names[1:])
+        ]
+        return PROMPTS["DEFAULT_RECORD_DELIMITER"].join(records) + PROMPTS["DEFAULT_COMPLETION_DELIMITER"]
+
+    def _respond(self, kind: str, prompt: str, rng: random.Random) -> str:
+        if kind == "extraction":
+            return self._records(rng, rng.randint(3, 6))
+        if kind == "glean":
+            # about half of the glean rounds find something that was missed
+            if rng.random() < 0.5:
+                return PROMPTS["DEFAULT_COMPLETION_DELIMITER"]
+            return self._records(rng, rng.randint(1, 2))
+        if kind == "summary":
+            return " ".join(rng.choices(WORDS, k=40))
+        if kind == "combined_rewrite":
+            return json.dumps({"entity_query": " ".join(rng.choices(WORDS, k=6)), "visual_query": " ".join(rng.choices(WORDS, k=6))})
+        if kind == "rewrite":
+            return " ".join(rng.choices(WORDS, k=6))
+        if kind == "segment_filter":
+            n_segments = len(re.findall(r"^\[\d+\]", prompt, re.MULTILINE))
+            return json.dumps({str(i): rng.randint(0, 10) for i in range(1, n_segments + 1)})
+        if kind == "batch_summary":
+            n_items = len(re.findall(r"^\[\d+\]", prompt, re.MULTILINE))
+            return json.dumps({str(i): " ".join(rng.choices(WORDS, k=40)) for i in range(1, n_items + 1)})
+        return " ".join(rng.choices(WORDS, k=200))
+
+    async def __call__(self, prompt, system_prompt=None, history_messages=[], **kwargs):
+        self.calls += 1
+        # the history carries the chunk, so each chunk's glean rounds get their own replies
+        history = "".join(message["content"] for message in history_messages)
+        rng = random.Random(f"{self.seed}:{history}:{prompt}")
+        await asyncio.sleep(self.latency + rng.uniform(0, self.jitter))
+        response = self._respond(self._kind(prompt), prompt, rng)
+        if kwargs.get("stream"):
+            return _stream(response)
+        return response
+
+
+async def _stream(response: str):
+    for word in response.split(" "):
+        yield word + " "
+
+
+def mock_embedding_func(embedding_dim: int = 1536, latency: float = 0.02):
+    """Seeded unit vectors, one request per call."""
+
+    @wrap_embedding_func_with_attrs(embedding_dim=embedding_dim, max_token_size=8192)
+    async def mock_embedding(texts: list[str]) -> np.ndarray:
+        await asyncio.sleep(latency)
+        vectors = np.stack(
+            [
+                np.random.default_rng(int.from_bytes(hashlib.blake2b(t.encode(), digest_size=8).digest(), "little")).standard_normal(embedding_dim)
+                for t in texts
+            ]
+        ).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    return mock_embedding
+
+
+class MockVideoSegmentVDB:
+    """Visual retrieval without ImageBind: a seeded pick of segment ids per query."""
+
+    def __init__(self, segment_ids: list[str], top_k: int = 5):
+        self.segment_ids = segment_ids
+        self.top_k = top_k
+
+    async def query(self, query: str):
+        rng = random.Random(query)
+        return [{"__id__": s_id} for s_id in rng.sample(self.segment_ids, min(self.top_k, len(self.segment_ids)))]
+
+
+def synthetic_videos(n_segments: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    videos = {}
+    for i in range(n_segments):
+        video_name = f"video_{i // SEGMENTS_PER_VIDEO}"
+        index = i % SEGMENTS_PER_VIDEO
+        videos.setdefault(video_name, {})[str(index)] = {
+            "time": f"{index * 30}-{(index + 1) * 30}",
+            "content": "Caption: " + " ".join(rng.choices(WORDS, k=rng.randint(20, 60)))
+            + "\nTranscript: " + " ".join(rng.choices(WORDS, k=int(30 * rng.uniform(1.5, 3.5)))),
+        }
+    return videos
+
+
+def percentiles(samples: list[float]) -> dict:
+    return {f"p{p}": float(np.percentile(samples, p)) for p in (50, 90, 99)}
+
+
+async def run(n_segments: int, args) -> dict:
+    llm = MockLLM(args.llm_latency, args.llm_jitter, entity_vocabulary=max(50, n_segments // 2), seed=args.seed)
+    model_func = limit_async_func_call(args.llm_max_async)(llm)
+    embedding_func = limit_async_func_call(args.embedding_max_async)(
+        mock_embedding_func(latency=args.embedding_latency)
+    )
+    working_dir = tempfile.mkdtemp(prefix="videorag-bench-")
+    global_config = dict(
+        working_dir=working_dir,
+        best_model_func=model_func,
+        cheap_model_func=model_func,
+        cheap_model_max_token_size=32768,
+        tiktoken_model_name="gpt-4o",
+        entity_extract_max_gleaning=args.max_gleaning,
+        entity_summary_to_max_tokens=500,
+        retrieval_topk_chunks=2,
+        fine_num_frames_per_segment=15,
+        embedding_func=embedding_func,
+        embedding_batch_num=32,
+        query_better_than_threshold=0.2,
+    )
+    video_segments = JsonKVStorage(namespace="video_segments", global_config=global_config)
+    video_path_db = JsonKVStorage(namespace="video_path", global_config=global_config)
+    text_chunks = JsonKVStorage(namespace="text_chunks", global_config=global_config)
+    chunks_vdb = NanoVectorDBStorage(namespace="chunks", global_config=global_config, embedding_func=embedding_func)
+    entities_vdb = NanoVectorDBStorage(
+        namespace="entities", global_config=global_config, embedding_func=embedding_func, meta_fields={"entity_name"}
+    )
+    graph = NetworkXStorage(namespace="chunk_entity_relation", global_config=global_config)
+
+    videos = synthetic_videos(n_segments, args.seed)
+    segment_feature_vdb = MockVideoSegmentVDB(
+        [f"{video_name}_{index}" for video_name, segments in videos.items() for index in segments]
+    )
+    await video_segments.upsert(videos)
+    await video_path_db.upsert({video_name: f"{video_name}.mp4" for video_name in videos})
+
+    reset_metrics()
+    gc.collect()
+    tracemalloc.start()
+    result = {"segments": n_segments}
+
+    start = time.perf_counter()
+    chunks = get_chunks(videos)
+    elapsed = time.perf_counter() - start
+    result["get_chunks"] = {"seconds": elapsed, "segments_per_second": n_segments / elapsed, "chunks": len(chunks)}
+
+    start = time.perf_counter()
+    await text_chunks.upsert(chunks)
+    await chunks_vdb.upsert(chunks)
+    extracted = await extract_entities(chunks, graph, entities_vdb, global_config)
+    elapsed = time.perf_counter() - start
+    result["extract_entities"] = {
+        "seconds": elapsed,
+        "chunks_per_second": len(chunks) / elapsed,
+        "entities": len(extracted[1]) if extracted else 0,
+        "relations": len(extracted[2]) if extracted else 0,
+    }
+
+    latencies = []
+    for i in range(args.queries):
+        start = time.perf_counter()
+        await videorag_query(
+            QUERIES[i % len(QUERIES)],
+            entities_vdb,
+            text_chunks,
+            chunks_vdb,
+            video_path_db,
+            video_segments,
+            segment_feature_vdb,
+            graph,
+            QueryParam(mode="videorag"),
+            global_config,
+        )
+        latencies.append(time.perf_counter() - start)
+    result["videorag_query"] = {
+        "queries": len(latencies),
+        "queries_per_second": len(latencies) / sum(latencies),
+        **percentiles(latencies),
+    }
+
+    result["peak_memory_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    result["llm_calls"] = llm.calls
+    result["stages"] = metrics_snapshot()
+    return result
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the indexing and query pipeline with mock providers.")
+    parser.add_argument("--segments", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--max-gleaning", type=int, default=1)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--llm-max-async", type=int, default=16)
+    parser.add_argument("--embedding-latency", type=float, default=0.02)
+    parser.add_argument("--embedding-max-async", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results here, e.g. to compare commits")
+    args = parser.parse_args()
+
+    results = {"revision": git_revision(), "config": vars(args), "runs": []}
+    for n_segments in args.segments:
+        result = asyncio.run(run(n_segments, args))
+        results["runs"].append(result)
+        query = result["videorag_query"]
+        print(
+            f"{n_segments:>6} segments | "
+            f"get_chunks {result['get_chunks']['seconds'] * 1000:8.1f} ms ({result['get_chunks']['chunks']} chunks) | "
+            f"extract {result['extract_entities']['seconds']:7.2f} s ({result['extract_entities']['chunks_per_second']:.1f} chunks/s) | "
+            f"query p50 {query['p50'] * 1000:.0f} ms p90 {query['p90'] * 1000:.0f} ms p99 {query['p99'] * 1000:.0f} ms | "
+            f"{result['llm_calls']} LLM calls | peak {result['peak_memory_mb']:.1f} MB"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,117 @@
+import re
+import time
+import random
+import asyncio
+import argparse
+
+from videorag._extraction_parser import parse_extraction_records
+from videorag._utils import clean_str, is_float_regex, split_string_by_multi_markers
+from videorag.prompt import PROMPTS
+
+DELIMITERS = dict(
+    tuple_delimiter=PROMPTS["DEFAULT_TUPLE_DELIMITER"],
+    record_delimiter=PROMPTS["DEFAULT_RECORD_DELIMITER"],
+    completion_delimiter=PROMPTS["DEFAULT_COMPLETION_DELIMITER"],
+)
+
+
+async def _reference_entity(record_attributes, chunk_key):
+    if len(record_attributes) < 4 or record_attributes[0] != '"entity"':
+        return None
+    entity_name = clean_str(record_attributes[1].upper())
+    if not entity_name.strip():
+        return None
+    return dict(
+        entity_name=entity_name,
+        entity_type=clean_str(record_attributes[2].upper()),
+        description=clean_str(record_attributes[3]),
+        source_id=chunk_key,
+    )
+
+
+async def _reference_relationship(record_attributes, chunk_key):
+    if len(record_attributes) < 5 or record_attributes[0] != '"relationship"':
+        return None
+    return dict(
+        src_id=clean_str(record_attributes[1].upper()),
+        tgt_id=clean_str(record_attributes[2].upper()),
+        weight=float(record_attributes[-1]) if is_float_regex(record_attributes[-1]) else 1.0,
+        description=clean_str(record_attributes[3]),
+        source_id=chunk_key,
+    )
+
+
+async def reference_parse(text, chunk_key, tuple_delimiter, record_delimiter, completion_delimiter):
+    # previous split / search / split chain with a coroutine per record, kept to check for identical output
+    entities, relationships = [], []
+    for record in split_string_by_multi_markers(text, [record_delimiter, completion_delimiter]):
+        record = re.search(r"\((.*)\)", record)
+        if record is None:
+            continue
+        record_attributes = split_string_by_multi_markers(record.group(1), [tuple_delimiter])
+        if_entities = await _reference_entity(record_attributes, chunk_key)
+        if if_entities is not None:
+            entities.append(if_entities)
+            continue
+        if_relation = await _reference_relationship(record_attributes, chunk_key)
+        if if_relation is not None:
+            relationships.append(if_relation)
+    return entities, relationships
+
+
+def synthetic_output(n_records, seed):
+    # mostly well-formed records plus the noise real replies contain
+    rng = random.Random(seed)
+    t = DELIMITERS["tuple_delimiter"]
+    names = [f"Move &amp; {i}" for i in range(max(2, n_records // 4))]
+    records = []
+    for _ in range(n_records):
+        roll = rng.random()
+        if roll < 0.55:
+            records.append(f'("entity"{t}"{rng.choice(names)}"{t}"TECHNIQUE"{t}"A step\x07 of the worm, {rng.random():.3f}")')
+        elif roll < 0.95:
+            records.append(
+                f'("relationship"{t}"{rng.choice(names)}"{t}"{rng.choice(names)}"{t}"leads into"{t}{rng.choice(["7", "0.5", "high"])})'
+            )
+        elif roll < 0.98:
+            records.append("Some prose the model added between records.")
+        else:
+            records.append(f'("entity"{t}""{t}"TECHNIQUE")')
+    return "\n" + f"{DELIMITERS['record_delimiter']}\n".join(records) + DELIMITERS["completion_delimiter"]
+
+
+async def reference_parse_all(texts):
+    return [await reference_parse(text, f"chunk-{i}", **DELIMITERS) for i, text in enumerate(texts)]
+
+
+def parse_all(texts):
+    return [parse_extraction_records(text, f"chunk-{i}", **DELIMITERS) for i, text in enumerate(texts)]
+
+
+def bench(func, texts, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = func(texts)
+        timings.append(time.perf_counter() - start)
+    return min(timings), results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark extraction record parsing.")
+    parser.add_argument("--replies", type=int, default=2000)
+    parser.add_argument("--records-per-reply", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    texts = [synthetic_output(args.records_per_reply, args.seed + i) for i in range(args.replies)]
+    print(f"{len(texts)} replies, {sum(map(len, texts)) / 2**20:.1f} MB")
+
+    loop = asyncio.new_event_loop()
+    ref_time, ref_result = bench(lambda texts: loop.run_until_complete(reference_parse_all(texts)), texts, args.repeat)
+    new_time, new_result = bench(parse_all, texts, args.repeat)
+    assert new_result == ref_result, "parser output differs from the reference implementation"
+    print(f"{sum(len(e) + len(r) for e, r in new_result)} records, identical output")
+    print(f"reference: {ref_time * 1000:.1f} ms")
+    print(f"compiled: {new_time * 1000:.1f} ms ({ref_time / new_time:.2f}x)")
@@ -13,6 +13,7 @@ load_dotenv()
 print("loaded API Key")
 from videorag._llm import *
 from videorag import VideoRAG, QueryParam
+from videorag._fingerprint import insert_video_incremental
 
 
 if __name__ == '__main__':
@@ -27,7 +28,7 @@ if __name__ == '__main__':
         "video_db/How to Do the Worm.mkv",
     ]
     videorag = VideoRAG(provider_in_use="gemini", working_dir=f"./videorag-workdir")
-    videorag.insert_video(video_path_list=video_paths)
+    insert_video_incremental(videorag, video_paths)
     
     print("Indexed Videos")
 
@@ -0,0 +1,149 @@
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import xxhash
+
+from ._utils import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process writers are serialized
+    fcntl = None
+
+# Unset: the cache lives in the working dir registered with use_working_dir_embedding_cache().
+# Set VIDEORAG_EMBEDDING_CACHE_DIR to a path to share one cache, or to "" to disable it.
+EMBEDDING_CACHE_DIR = os.getenv("VIDEORAG_EMBEDDING_CACHE_DIR")
+# float16 halves the file size; a hit then differs from a fresh API vector by
+# ~1e-3 relative per component, well below what changes retrieval ranking.
+# Use np.float32 if bit-exact vectors matter.
+EMBEDDING_CACHE_DTYPE = np.float16
+# Rows per model; once full, new embeddings are still returned but not cached.
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv("VIDEORAG_EMBEDDING_CACHE_MAX_ROWS", "2000000"))
+
+_working_dir_cache_dir = None
+
+
+def use_working_dir_embedding_cache(working_dir: str):
+    """Keep cached embeddings under ``working_dir`` unless VIDEORAG_EMBEDDING_CACHE_DIR is set."""
+    global _working_dir_cache_dir
+    _working_dir_cache_dir = os.path.join(working_dir, "embedding-cache")
+
+
+def embedding_cache_key(text: str) -> int:
+    return xxhash.xxh3_64_intdigest(text.encode())
+
+
+class EmbeddingCache:
+    """Append-only vector store for one embedding model.
+
+    ``vectors.bin`` is a row-major memmap of ``embedding_dim`` values per row and
+    ``keys.u64`` holds the content hash of each row at the same position, so the
+    in-memory index is rebuilt from the keys file on load. Appends hold an
+    exclusive lock on ``lock`` and first pick up rows other processes added.
+    """
+
+    def __init__(self, cache_dir: str, model: str, embedding_dim: int, dtype=EMBEDDING_CACHE_DTYPE):
+        self.embedding_dim = embedding_dim
+        self.dtype = np.dtype(dtype)
+        model_dir = os.path.join(cache_dir, f"{model}-{embedding_dim}-{self.dtype.name}")
+        os.makedirs(model_dir, exist_ok=True)
+        self._vectors_path = os.path.join(model_dir, "vectors.bin")
+        self._keys_path = os.path.join(model_dir, "keys.u64")
+        self._lock_path = os.path.join(model_dir, "lock")
+        self._row_bytes = embedding_dim * self.dtype.itemsize
+        self._count = 0
+        self._rows = {}
+        self._memmap = None
+        self._lock = threading.Lock()
+        with self._lock, self._file_lock():
+            self._sync()
+        logger.info(f"Loaded {self._count} cached embeddings from {model_dir}")
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self._lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _sync(self):
+        # must hold both locks: re-derive the row count from the files
+        key_rows = os.path.getsize(self._keys_path) // 8 if os.path.exists(self._keys_path) else 0
+        vector_rows = (
+            os.path.getsize(self._vectors_path) // self._row_bytes
+            if os.path.exists(self._vectors_path)
+            else 0
+        )
+        # an interrupted append can leave one file longer than the other
+        count = min(key_rows, vector_rows)
+        for path, size in ((self._keys_path, count * 8), (self._vectors_path, count * self._row_bytes)):
+            with open(path, "ab") as f:
+                f.truncate(size)
+        if count > self._count:
+            new_keys = np.fromfile(
+                self._keys_path, dtype=np.uint64, count=count - self._count, offset=self._count * 8
+            )
+            for i, k in enumerate(new_keys, start=self._count):
+                self._rows.setdefault(int(k), i)
+        elif count < self._count:
+            # another process repaired a torn append we had indexed; start over
+            self._rows = {
+                int(k): i for i, k in enumerate(np.fromfile(self._keys_path, dtype=np.uint64))
+            }
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def lookup(self, keys: list[int]) -> np.ndarray:
+        """Row of each key, or -1 when it is not cached."""
+        return np.array([self._rows.get(k, -1) for k in keys], dtype=np.int64)
+
+    def get(self, rows: np.ndarray) -> np.ndarray:
+        with self._lock:
+            if self._memmap is None or len(self._memmap) < self._count:
+                self._memmap = np.memmap(
+                    self._vectors_path,
+                    dtype=self.dtype,
+                    mode="r",
+                    shape=(self._count, self.embedding_dim),
+                )
+            return np.asarray(self._memmap[rows], dtype=np.float32)
+
+    def add(self, keys: list[int], vectors: np.ndarray):
+        with self._lock, self._file_lock():
+            self._sync()
+            new = [(k, v) for k, v in zip(keys, vectors) if k not in self._rows]
+            new = new[: max(0, EMBEDDING_CACHE_MAX_ROWS - self._count)]
+            if not new:
+                return
+            with open(self._vectors_path, "ab") as f:
+                f.write(np.asarray([v for _, v in new], dtype=self.dtype).tobytes())
+            with open(self._keys_path, "ab") as f:
+                f.write(np.asarray([k for k, _ in new], dtype=np.uint64).tobytes())
+            for k, _ in new:
+                self._rows[k] = self._count
+                self._count += 1
+            if self._count >= EMBEDDING_CACHE_MAX_ROWS:
+                logger.warning(f"Embedding cache is full ({self._count} rows), new embeddings are not cached")
+
+
+_caches: dict[tuple, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model: str, embedding_dim: int):
+    cache_dir = EMBEDDING_CACHE_DIR if EMBEDDING_CACHE_DIR is not None else _working_dir_cache_dir
+    if not cache_dir:
+        return None
+    with _caches_lock:
+        key = (cache_dir, model, embedding_dim)
+        if key not in _caches:
+            _caches[key] = EmbeddingCache(cache_dir, model, embedding_dim)
+        return _caches[key]
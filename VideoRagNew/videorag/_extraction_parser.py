@@ -0,0 +1,82 @@
+import re
+import html
+from functools import lru_cache
+from typing import TypedDict
+
+
+class EntityRecord(TypedDict):
+    entity_name: str
+    entity_type: str
+    description: str
+    source_id: str
+
+
+class RelationshipRecord(TypedDict):
+    src_id: str
+    tgt_id: str
+    weight: float
+    description: str
+    source_id: str
+
+
+_RECORD_BODY = re.compile(r"\((.*)\)")
+_CONTROL_CHARS = re.compile(r"[\x00-\x1f\x7f-\x9f]")
+_FLOAT = re.compile(r"^[-+]?[0-9]*\.?[0-9]+$")
+
+
+def _clean(value: str) -> str:
+    # same as _utils.clean_str for strings
+    return _CONTROL_CHARS.sub("", html.unescape(value.strip()))
+
+
+@lru_cache(maxsize=None)
+def _record_splitter(record_delimiter: str, completion_delimiter: str):
+    return re.compile(
+        "|".join(re.escape(marker) for marker in (record_delimiter, completion_delimiter))
+    ).split
+
+
+def parse_extraction_records(
+    text: str,
+    chunk_key: str,
+    tuple_delimiter: str,
+    record_delimiter: str,
+    completion_delimiter: str,
+) -> tuple[list[EntityRecord], list[RelationshipRecord]]:
+    """Entity and relationship records from one extraction reply.
+
+    Accepts the same input as the old split / search / split chain with the
+    per-record entity and relationship handlers, and returns the same records.
+    """
+    entities = []
+    relationships = []
+    for record in _record_splitter(record_delimiter, completion_delimiter)(text):
+        body = _RECORD_BODY.search(record)
+        if body is None:
+            continue
+        attributes = [a for a in (a.strip() for a in body.group(1).split(tuple_delimiter)) if a]
+        if not attributes:
+            continue
+        kind = attributes[0]
+        if kind == '"entity"' and len(attributes) >= 4:
+            entity_name = _clean(attributes[1].upper())
+            if entity_name.strip():
+                entities.append(
+                    EntityRecord(
+                        entity_name=entity_name,
+                        entity_type=_clean(attributes[2].upper()),
+                        description=_clean(attributes[3]),
+                        source_id=chunk_key,
+                    )
+                )
+        elif kind == '"relationship"' and len(attributes) >= 5:
+            relationships.append(
+                RelationshipRecord(
+                    src_id=_clean(attributes[1].upper()),
+                    tgt_id=_clean(attributes[2].upper()),
+                    weight=float(attributes[-1]) if _FLOAT.match(attributes[-1]) else 1.0,
+                    description=_clean(attributes[3]),
+                    source_id=chunk_key,
+                )
+            )
+    return entities, relationships
@@ -0,0 +1,131 @@
+import os
+import asyncio
+from dataclasses import asdict
+
+import xxhash
+
+from ._utils import logger, always_get_an_event_loop, compute_mdhash_id
+from ._graph_bulk import remove_sources
+from ._embedding_cache import use_working_dir_embedding_cache
+
+FINGERPRINT_NAMESPACE = "video_fingerprints"
+FINGERPRINT_BLOCK_SIZE = 1 << 20
+FINGERPRINT_NUM_BLOCKS = 16
+
+
+def compute_video_fingerprint(
+    video_path: str,
+    block_size: int = FINGERPRINT_BLOCK_SIZE,
+    num_blocks: int = FINGERPRINT_NUM_BLOCKS,
+) -> str:
+    """xxh3 over the file size plus evenly spaced blocks (the whole file when small)."""
+    file_size = os.path.getsize(video_path)
+    hasher = xxhash.xxh3_128()
+    hasher.update(str(file_size).encode())
+    with open(video_path, "rb") as f:
+        if file_size <= block_size * num_blocks:
+            for block in iter(lambda: f.read(block_size), b""):
+                hasher.update(block)
+        else:
+            step = (file_size - block_size) // (num_blocks - 1)
+            for i in range(num_blocks):
+                f.seek(i * step)
+                hasher.update(f.read(block_size))
+    return hasher.hexdigest()
+
+
+def _video_name(video_path: str) -> str:
+    # same naming rule as VideoRAG.insert_video
+    return os.path.basename(video_path).split(".")[0]
+
+
+def _owned_by(segment_ids: list[str], video_name: str) -> bool:
+    # parse the name like the query path does: "clip_2_0" belongs to "clip_2", not "clip"
+    return bool(segment_ids) and all(
+        '_'.join(s_id.split('_')[:-1]) == video_name for s_id in segment_ids
+    )
+
+
+async def _drop_video(rag, video_name: str):
+    """Remove one video's segments, chunks and segment vectors, and their traces in the graph.
+
+    Entities and relations lose the dropped chunks as sources; those left with
+    none are deleted, along with their entity vectors.
+    """
+    segment_ids = [
+        f"{video_name}_{index}" for index in rag.video_segments._data.get(video_name, {})
+    ]
+    rag.video_segments._data.pop(video_name, None)
+    rag.video_path_db._data.pop(video_name, None)
+    chunk_ids = [
+        k
+        for k, v in rag.text_chunks._data.items()
+        if _owned_by(v.get("video_segment_id", []), video_name)
+    ]
+    for k in chunk_ids:
+        rag.text_chunks._data.pop(k)
+    if chunk_ids:
+        rag.chunks_vdb._client.delete(chunk_ids)
+    if segment_ids:
+        rag.video_segment_feature_vdb._client.delete(segment_ids)
+    dropped_entities = await remove_sources(rag.chunk_entity_relation_graph, chunk_ids)
+    if dropped_entities:
+        rag.entities_vdb._client.delete(
+            [compute_mdhash_id(entity_name, prefix="ent-") for entity_name in dropped_entities]
+        )
+    logger.info(
+        f"Dropped {len(segment_ids)} segments, {len(chunk_ids)} chunks and "
+        f"{len(dropped_entities)} entities of changed video {video_name}"
+    )
+
+
+async def _plan_insert(rag, fingerprint_kv, video_path_list: list[str]):
+    fingerprints = await asyncio.gather(
+        *[asyncio.to_thread(compute_video_fingerprint, p) for p in video_path_list]
+    )
+    known_names = await fingerprint_kv.all_keys()
+    known = dict(zip(known_names, await fingerprint_kv.get_by_ids(known_names)))
+    seen_fingerprints = {v["fingerprint"] for v in known.values() if v is not None}
+
+    new_paths, new_records = [], {}
+    for video_path, fingerprint in zip(video_path_list, fingerprints):
+        video_name = _video_name(video_path)
+        if fingerprint in seen_fingerprints:
+            logger.info(f"Video {video_path} is already indexed, skip it")
+            continue
+        seen_fingerprints.add(fingerprint)
+        record = {"fingerprint": fingerprint, "video_path": video_path}
+        if video_name in rag.video_segments._data:
+            if video_name not in known:
+                # indexed before fingerprints were recorded, adopt it as-is
+                await fingerprint_kv.upsert({video_name: record})
+                continue
+            # same name, different content: re-index only this video
+            await _drop_video(rag, video_name)
+        new_paths.append(video_path)
+        new_records[video_name] = record
+    return new_paths, new_records
+
+
+def insert_video_incremental(rag, video_path_list: list[str]):
+    """Run ``rag.insert_video`` only for videos whose content is not indexed yet.
+
+    Videos are keyed by a content fingerprint stored in the working dir, so
+    unchanged files are skipped and a changed file replaces only its own
+    segments and chunks before being inserted again.
+    """
+    use_working_dir_embedding_cache(rag.working_dir)
+    loop = always_get_an_event_loop()
+    fingerprint_kv = rag.key_string_value_json_storage_cls(
+        namespace=FINGERPRINT_NAMESPACE, global_config=asdict(rag)
+    )
+    new_paths, new_records = loop.run_until_complete(
+        _plan_insert(rag, fingerprint_kv, video_path_list)
+    )
+    if not new_paths:
+        logger.info("All videos are already indexed")
+        loop.run_until_complete(fingerprint_kv.index_done_callback())
+        return
+    rag.insert_video(video_path_list=new_paths)
+    loop.run_until_complete(fingerprint_kv.upsert(new_records))
+    loop.run_until_complete(fingerprint_kv.index_done_callback())
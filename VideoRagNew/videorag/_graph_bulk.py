@@ -0,0 +1,208 @@
+import asyncio
+from typing import Union
+
+from .base import BaseGraphStorage
+from .prompt import GRAPH_FIELD_SEP
+
+# Rows per UNWIND statement; larger batches mean fewer round trips but bigger transactions.
+NEO4J_BULK_BATCH_SIZE = 1000
+
+
+def _batches(items: list, batch_size: int = NEO4J_BULK_BATCH_SIZE):
+    for i in range(0, len(items), batch_size):
+        yield items[i : i + batch_size]
+
+
+def _is_neo4j(graph: BaseGraphStorage) -> bool:
+    return hasattr(graph, "async_driver")
+
+
+async def _neo4j_read(graph: BaseGraphStorage, query: str, **params) -> list:
+    async with graph.async_driver.session() as session:
+        result = await session.run(query, **params)
+        return [record async for record in result]
+
+
+async def _neo4j_write(graph: BaseGraphStorage, query: str, **params):
+    async with graph.async_driver.session() as session:
+        result = await session.run(query, **params)
+        await result.consume()
+
+
+async def get_nodes(graph: BaseGraphStorage, node_ids: list[str]) -> list[Union[dict, None]]:
+    """Node data for each id (None where missing), in as few round trips as the backend allows."""
+    if hasattr(graph, "get_nodes"):
+        return await graph.get_nodes(node_ids)
+    if not _is_neo4j(graph):
+        return await asyncio.gather(*[graph.get_node(node_id) for node_id in node_ids])
+    found = {}
+    for batch in _batches(node_ids):
+        for record in await _neo4j_read(
+            graph,
+            f"UNWIND $node_ids AS node_id MATCH (n:{graph.namespace}) WHERE n.id = node_id "
+            "RETURN node_id, properties(n) AS node_data",
+            node_ids=batch,
+        ):
+            found[record["node_id"]] = record["node_data"]
+    return [found.get(node_id) for node_id in node_ids]
+
+
+async def upsert_nodes(graph: BaseGraphStorage, nodes: list[tuple[str, dict]]):
+    if hasattr(graph, "upsert_nodes"):
+        return await graph.upsert_nodes(nodes)
+    if not _is_neo4j(graph):
+        await asyncio.gather(
+            *[graph.upsert_node(node_id, node_data=node_data) for node_id, node_data in nodes]
+        )
+        return
+    # labels can't be parameters, so each entity type gets its own statement
+    by_type = {}
+    for node_id, node_data in nodes:
+        node_type = node_data.get("entity_type", "UNKNOWN").strip('"')
+        by_type.setdefault(node_type, []).append({"id": node_id, "data": node_data})
+    for node_type, rows in by_type.items():
+        for batch in _batches(rows):
+            await _neo4j_write(
+                graph,
+                f"UNWIND $rows AS row MERGE (n:{graph.namespace}:`{node_type}` {{id: row.id}}) "
+                "SET n += row.data",
+                rows=batch,
+            )
+
+
+async def get_edges(graph: BaseGraphStorage, edges: list[tuple[str, str]]) -> list[Union[dict, None]]:
+    """Edge data for each (source, target) pair, None where there is no edge."""
+    if hasattr(graph, "get_edges"):
+        return await graph.get_edges(edges)
+    if not _is_neo4j(graph):
+
+        async def _get_edge(source_id, target_id):
+            if not await graph.has_edge(source_id, target_id):
+                return None
+            return await graph.get_edge(source_id, target_id)
+
+        return await asyncio.gather(*[_get_edge(s, t) for s, t in edges])
+    found = {}
+    for batch in _batches([{"source_id": s, "target_id": t} for s, t in edges]):
+        for record in await _neo4j_read(
+            graph,
+            f"UNWIND $pairs AS pair MATCH (s:{graph.namespace})-[r]->(t:{graph.namespace}) "
+            "WHERE s.id = pair.source_id AND t.id = pair.target_id "
+            "RETURN pair.source_id AS source_id, pair.target_id AS target_id, properties(r) AS edge_data",
+            pairs=batch,
+        ):
+            found[(record["source_id"], record["target_id"])] = record["edge_data"]
+    return [found.get(edge) for edge in edges]
+
+
+async def upsert_edges(graph: BaseGraphStorage, edges: list[tuple[str, str, dict]]):
+    if hasattr(graph, "upsert_edges"):
+        return await graph.upsert_edges(edges)
+    if not _is_neo4j(graph):
+        await asyncio.gather(
+            *[graph.upsert_edge(s, t, edge_data=edge_data) for s, t, edge_data in edges]
+        )
+        return
+    rows = [{"source_id": s, "target_id": t, "data": edge_data} for s, t, edge_data in edges]
+    for batch in _batches(rows):
+        await _neo4j_write(
+            graph,
+            f"UNWIND $rows AS row MATCH (s:{graph.namespace}), (t:{graph.namespace}) "
+            "WHERE s.id = row.source_id AND t.id = row.target_id "
+            "MERGE (s)-[r:RELATED]->(t) SET r += row.data",
+            rows=batch,
+        )
+
+
+def _without_sources(source_id: str, chunk_ids: set[str]) -> str:
+    return GRAPH_FIELD_SEP.join(s for s in source_id.split(GRAPH_FIELD_SEP) if s not in chunk_ids)
+
+
+async def remove_sources(graph: BaseGraphStorage, chunk_ids: list[str]) -> list[str]:
+    """Strip ``chunk_ids`` from every node and edge ``source_id``.
+
+    Nodes and edges left without any source are deleted (with their edges, for
+    nodes); the ids of the deleted nodes are returned. Descriptions merged from
+    the removed chunks are kept.
+    """
+    chunk_ids = set(chunk_ids)
+    if not chunk_ids:
+        return []
+    if _is_neo4j(graph):
+        nodes = [
+            (record["node_id"], record["source_id"] or "")
+            for record in await _neo4j_read(
+                graph, f"MATCH (n:{graph.namespace}) RETURN n.id AS node_id, n.source_id AS source_id"
+            )
+        ]
+        edges = [
+            (record["source"], record["target"], record["source_id"] or "")
+            for record in await _neo4j_read(
+                graph,
+                f"MATCH (s:{graph.namespace})-[r]->(t:{graph.namespace}) "
+                "RETURN s.id AS source, t.id AS target, r.source_id AS source_id",
+            )
+        ]
+    elif hasattr(graph, "_graph"):
+        # NetworkXStorage
+        nodes = [(n, d.get("source_id", "")) for n, d in graph._graph.nodes(data=True)]
+        edges = [(s, t, d.get("source_id", "")) for s, t, d in graph._graph.edges(data=True)]
+    else:
+        raise NotImplementedError(f"Cannot remove sources from {type(graph).__name__}")
+
+    node_updates, node_deletes = [], []
+    for node_id, source_id in nodes:
+        kept = _without_sources(source_id, chunk_ids)
+        if kept == source_id:
+            continue
+        if kept:
+            node_updates.append((node_id, kept))
+        else:
+            node_deletes.append(node_id)
+    edge_updates, edge_deletes = [], []
+    for source, target, source_id in edges:
+        kept = _without_sources(source_id, chunk_ids)
+        if kept == source_id:
+            continue
+        if kept:
+            edge_updates.append((source, target, kept))
+        else:
+            edge_deletes.append((source, target))
+
+    if _is_neo4j(graph):
+        for batch in _batches([{"id": n, "source_id": s} for n, s in node_updates]):
+            await _neo4j_write(
+                graph,
+                f"UNWIND $rows AS row MATCH (n:{graph.namespace}) WHERE n.id = row.id "
+                "SET n.source_id = row.source_id",
+                rows=batch,
+            )
+        for batch in _batches([{"source": s, "target": t, "source_id": i} for s, t, i in edge_updates]):
+            await _neo4j_write(
+                graph,
+                f"UNWIND $rows AS row MATCH (s:{graph.namespace})-[r]->(t:{graph.namespace}) "
+                "WHERE s.id = row.source AND t.id = row.target SET r.source_id = row.source_id",
+                rows=batch,
+            )
+        for batch in _batches([{"source": s, "target": t} for s, t in edge_deletes]):
+            await _neo4j_write(
+                graph,
+                f"UNWIND $rows AS row MATCH (s:{graph.namespace})-[r]->(t:{graph.namespace}) "
+                "WHERE s.id = row.source AND t.id = row.target DELETE r",
+                rows=batch,
+            )
+        for batch in _batches(node_deletes):
+            await _neo4j_write(
+                graph,
+                f"UNWIND $node_ids AS node_id MATCH (n:{graph.namespace}) WHERE n.id = node_id "
+                "DETACH DELETE n",
+                node_ids=batch,
+            )
+    else:
+        for node_id, source_id in node_updates:
+            graph._graph.nodes[node_id]["source_id"] = source_id
+        for source, target, source_id in edge_updates:
+            graph._graph.edges[source, target]["source_id"] = source_id
+        graph._graph.remove_edges_from(edge_deletes)
+        graph._graph.remove_nodes_from(node_deletes)
+    return node_deletes
@@ -1,45 +1,285 @@
 import numpy as np
 
-from openai import AsyncOpenAI, AsyncAzureOpenAI, APIConnectionError, RateLimitError
+from openai import (
+    AsyncOpenAI,
+    AsyncAzureOpenAI,
+    APIConnectionError,
+    APITimeoutError,
+    InternalServerError,
+    RateLimitError,
+)
 
 from tenacity import (
     retry,
     stop_after_attempt,
-    wait_exponential,
+    wait_random_exponential,
     retry_if_exception_type,
 )
 import os
-
-from ._utils import compute_args_hash, wrap_embedding_func_with_attrs
+import time
+import heapq
+import atexit
+import asyncio
+import weakref
+from contextlib import AsyncExitStack
+
+from ._embedding_cache import embedding_cache_key, get_embedding_cache
+from ._metrics import record_embedding, record_llm_call
+from ._ratelimit import estimate_tokens, get_rate_limiter
+from ._tokenizer import TOKENIZER_NUM_THREADS, get_tiktoken_encoding
+from ._trace import span
+from ._utils import (
+    compute_args_hash,
+    logger,
+    wrap_embedding_func_with_attrs,
+)
 from .base import BaseKVStorage
 
-global_openai_async_client = None
-global_azure_openai_async_client = None
-global_gemini_async_client = None
+# SDK retries are off (max_retries=0) so 429s reach the shared rate limiter;
+# tenacity retries these instead, including the transient 5xx and timeouts
+# the SDK would otherwise have retried.
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+# httpx connection pools belong to the event loop that opened them, and the
+# service, do_rag and every Streamlit script run drive the clients from
+# different loops, so each loop gets its own clients.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _loop_client(provider: str, make_client):
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    if provider not in clients:
+        clients[provider] = make_client()
+    return clients[provider]
+
 
 def get_openai_async_client_instance():
-    global global_openai_async_client
-    if global_openai_async_client is None:
-        global_openai_async_client = AsyncOpenAI()
-    return global_openai_async_client
+    return _loop_client("openai", lambda: AsyncOpenAI(max_retries=0))
 
 
 def get_azure_openai_async_client_instance():
-    global global_azure_openai_async_client
-    if global_azure_openai_async_client is None:
-        global_azure_openai_async_client = AsyncAzureOpenAI()
-    return global_azure_openai_async_client
+    return _loop_client("azure", lambda: AsyncAzureOpenAI(max_retries=0))
 
 def get_gemini_async_client_instance():
-    global global_gemini_async_client
-    if global_gemini_async_client is None:
-        global_gemini_async_client = AsyncOpenAI(api_key=os.getenv("GEMINI_API_KEY"), base_url=os.getenv("GEMINI_EXPERIMENTAL_OPENAI_URL"))
-    return global_gemini_async_client
+    return _loop_client(
+        "gemini",
+        lambda: AsyncOpenAI(api_key=os.getenv("GEMINI_API_KEY"), base_url=os.getenv("GEMINI_EXPERIMENTAL_OPENAI_URL"), max_retries=0),
+    )
+
+LLM_CACHE_FLUSH_EVERY = 64
+LLM_CACHE_FLUSH_INTERVAL = 30
+LLM_CACHE_MAX_ENTRIES = 100_000
+LLM_CACHE_TTL = 30 * 24 * 3600
+
+
+class _ResponseCache:
+    """Write-behind front for a ``hashing_kv``.
+
+    Upserts are buffered and the store is only persisted (``index_done_callback``)
+    every ``LLM_CACHE_FLUSH_EVERY`` writes, after ``LLM_CACHE_FLUSH_INTERVAL``
+    seconds, or at shutdown. Entries carry a last-use time used for TTL expiry
+    and LRU eviction down to ``LLM_CACHE_MAX_ENTRIES`` when the store is flushed.
+    """
+
+    def __init__(self, kv: BaseKVStorage):
+        self.kv = kv
+        self._pending = 0
+        self._touched = {}
+        self._last_flush = time.monotonic()
+
+    async def get(self, args_hash: str):
+        record = await self.kv.get_by_id(args_hash)
+        if record is None:
+            return None
+        now = time.time()
+        if now - record.get("time", now) > LLM_CACHE_TTL:
+            return None
+        self._touched[args_hash] = record
+        return record["return"]
+
+    async def put(self, args_hash: str, content: str, model: str):
+        await self.kv.upsert(
+            {args_hash: {"return": content, "model": model, "time": time.time()}}
+        )
+        self._pending += 1
+        if (
+            self._pending >= LLM_CACHE_FLUSH_EVERY
+            or time.monotonic() - self._last_flush >= LLM_CACHE_FLUSH_INTERVAL
+        ):
+            await self.flush()
+
+    def _evict(self):
+        # only JSON-backed stores expose their records; other backends manage their own size
+        data = getattr(self.kv, "_data", None)
+        if data is None:
+            return
+        now = time.time()
+        for k in [k for k, v in data.items() if now - v.get("time", now) > LLM_CACHE_TTL]:
+            data.pop(k)
+        overflow = len(data) - LLM_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            for k in heapq.nsmallest(overflow, data, key=lambda k: data[k].get("time", 0)):
+                data.pop(k)
+
+    async def flush(self):
+        if not self._pending and not self._touched:
+            return
+        touched, self._touched = self._touched, {}
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        if touched:
+            now = time.time()
+            await self.kv.upsert({k: {**v, "time": now} for k, v in touched.items()})
+        self._evict()
+        await self.kv.index_done_callback()
+
+
+# The cache lives on its KV object, so both are collected together; a dict keyed
+# by the KV (even a WeakKeyDictionary, whose values would point back at it) keeps
+# every store ever passed in alive.
+_response_caches = weakref.WeakSet()
+
+
+def get_response_cache(hashing_kv: BaseKVStorage) -> _ResponseCache:
+    cache = getattr(hashing_kv, "_response_cache", None)
+    if cache is None:
+        cache = _ResponseCache(hashing_kv)
+        hashing_kv._response_cache = cache
+        _response_caches.add(cache)
+    return cache
+
+
+async def flush_llm_response_caches():
+    for cache in list(_response_caches):
+        await cache.flush()
+
+
+@atexit.register
+def _flush_llm_response_caches_at_exit():
+    if any(c._pending or c._touched for c in list(_response_caches)):
+        try:
+            asyncio.run(flush_llm_response_caches())
+        except Exception as e:
+            logger.warning(f"Failed to flush LLM response cache at exit: {e}")
+
+
+_inflight_calls: dict[tuple, asyncio.Task] = {}
+
+
+async def _single_flight(key: str, make_call):
+    """Concurrent callers with the same key share one pending upstream call."""
+    key = (id(asyncio.get_running_loop()), key)
+    task = _inflight_calls.get(key)
+    if task is None:
+        task = asyncio.ensure_future(make_call())
+        _inflight_calls[key] = task
+
+        def _forget(done_task):
+            if _inflight_calls.get(key) is done_task:
+                del _inflight_calls[key]
+
+        task.add_done_callback(_forget)
+    # shield: one cancelled caller must not cancel the call for the others
+    return await asyncio.shield(task)
+
+
+@retry(
+    stop=stop_after_attempt(5),
+    wait=wait_random_exponential(multiplier=1, max=10),
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+)
+async def _open_chat_stream(provider, client, model, messages, estimated_tokens, **kwargs):
+    """Take a rate limiter slot and open the stream, retried until it is open.
+
+    Nothing has been yielded yet, so retrying here is safe. The returned stack
+    holds the slot and must be closed once the stream is consumed.
+    """
+    slot = AsyncExitStack()
+    await slot.enter_async_context(get_rate_limiter(provider).limit(estimated_tokens))
+    try:
+        response = await client.chat.completions.create(
+            model=model, messages=messages, stream=True, **kwargs
+        )
+    except BaseException as e:
+        # the limiter backs off on a 429 before tenacity retries
+        await slot.__aexit__(type(e), e, e.__traceback__)
+        raise
+    return slot, response
+
+
+async def _chat_complete_stream(provider, client, model, messages, hashing_kv, **kwargs):
+    if hashing_kv is not None:
+        args_hash = compute_args_hash(model, messages)
+        if_cache_return = await get_response_cache(hashing_kv).get(args_hash)
+        if if_cache_return is not None:
+            record_llm_call(cached=True)
+            yield if_cache_return
+            return
+
+    parts = []
+    estimated_tokens = estimate_tokens(m["content"] for m in messages) + kwargs.get(
+        "max_tokens", 0
+    )
+    slot, response = await _open_chat_stream(
+        provider, client, model, messages, estimated_tokens, **kwargs
+    )
+    async with slot:
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield parts[-1]
+    # streamed responses carry no usage block, so both sides are estimated
+    record_llm_call(estimate_tokens(m["content"] for m in messages), estimate_tokens(parts))
+    # only a fully received answer is cached
+    if hashing_kv is not None:
+        await get_response_cache(hashing_kv).put(args_hash, "".join(parts), model)
+
+
+async def _chat_complete(provider, client, model, messages, hashing_kv, **kwargs):
+    """Cached completion; with ``stream=True`` returns an async iterator of text deltas."""
+    if kwargs.pop("stream", False):
+        return _chat_complete_stream(provider, client, model, messages, hashing_kv, **kwargs)
+    with span(
+        "llm",
+        model=model,
+        prompt_chars=sum(len(m["content"]) for m in messages),
+    ) as call_span:
+        if hashing_kv is not None:
+            args_hash = compute_args_hash(model, messages)
+            if_cache_return = await get_response_cache(hashing_kv).get(args_hash)
+            if if_cache_return is not None:
+                call_span.set(cached=True)
+                record_llm_call(cached=True)
+                return if_cache_return
+
+        async def _call():
+            estimated_tokens = estimate_tokens(m["content"] for m in messages) + kwargs.get(
+                "max_tokens", 0
+            )
+            async with get_rate_limiter(provider).limit(estimated_tokens) as usage:
+                response = await client.chat.completions.create(
+                    model=model, messages=messages, **kwargs
+                )
+                if response.usage is not None:
+                    usage.tokens = response.usage.total_tokens
+            if response.usage is not None:
+                record_llm_call(response.usage.prompt_tokens, response.usage.completion_tokens)
+            else:
+                record_llm_call()
+            content = response.choices[0].message.content
+            if hashing_kv is not None:
+                await get_response_cache(hashing_kv).put(args_hash, content, model)
+            return content
+
+        content = await _single_flight(compute_args_hash(model, messages, kwargs), _call)
+        call_span.set(cached=False, completion_chars=len(content or ""))
+        return content
+
 
 @retry(
     stop=stop_after_attempt(5),
-    wait=wait_exponential(multiplier=1, min=4, max=10),
-    retry=retry_if_exception_type((RateLimitError, APIConnectionError)),
+    wait=wait_random_exponential(multiplier=1, max=10),
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
 )
 async def openai_complete_if_cache(
     model, prompt, system_prompt=None, history_messages=[], **kwargs
@@ -51,57 +291,29 @@ async def openai_complete_if_cache(
         messages.append({"role": "system", "content": system_prompt})
     messages.extend(history_messages)
     messages.append({"role": "user", "content": prompt})
-    if hashing_kv is not None:
-        args_hash = compute_args_hash(model, messages)
-        if_cache_return = await hashing_kv.get_by_id(args_hash)
-        if if_cache_return is not None:
-            return if_cache_return["return"]
-
-    response = await openai_async_client.chat.completions.create(
-        model=model, messages=messages, **kwargs
+    return await _chat_complete(
+        "openai", openai_async_client, model, messages, hashing_kv, **kwargs
     )
 
-    if hashing_kv is not None:
-        await hashing_kv.upsert(
-            {args_hash: {"return": response.choices[0].message.content, "model": model}}
-        )
-        await hashing_kv.index_done_callback()
-    return response.choices[0].message.content
-
+@retry(
+    stop=stop_after_attempt(5),
+    wait=wait_random_exponential(multiplier=1, max=10),
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+)
 async def gemini_complete_if_cache(
     model, prompt, system_prompt=None, history_messages=[], **kwargs
 ) -> str:
     gemini_async_client = get_gemini_async_client_instance()
     hashing_kv: BaseKVStorage = kwargs.pop("hashing_kv", None)
     messages = []
-
-    print("prompt", flush=True)
-    print(prompt, flush=True)
-
-    print("system prompt", flush=True)
-    print(system_prompt, flush=True)
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
     messages.extend(history_messages)
     messages.append({"role": "user", "content": prompt})
-    if hashing_kv is not None:
-        args_hash = compute_args_hash(model, messages)
-        if_cache_return = await hashing_kv.get_by_id(args_hash)
-        if if_cache_return is not None:
-            return if_cache_return["return"]
-
-
-    response = await gemini_async_client.chat.completions.create(
-        model=model, messages=messages, **kwargs
+    return await _chat_complete(
+        "gemini", gemini_async_client, model, messages, hashing_kv, **kwargs
     )
 
-    if hashing_kv is not None:
-        await hashing_kv.upsert(
-            {args_hash: {"return": response.choices[0].message.content, "model": model}}
-        )
-        await hashing_kv.index_done_callback()
-    return response.choices[0].message.content
-
 async def gpt_4o_complete(
     prompt, system_prompt=None, history_messages=[], **kwargs
 ) -> str:
@@ -116,9 +328,6 @@ async def gpt_4o_complete(
 async def gemini_flash_2_complete(
         prompt, system_prompt=None, history_messages=[], **kwargs
 ) -> str:
-    print("************************************************************************************")
-    print(f"Prompt: \n{prompt}")
-    print("************************************************************************************")    
     return await gemini_complete_if_cache(
         "gemini-2.0-flash",
         prompt,
@@ -140,40 +349,164 @@ async def gpt_4o_mini_complete(
     )
 
 
+# Per-request limits of each provider's embeddings endpoint
+EMBEDDING_BATCH_LIMITS = {
+    "openai": dict(max_batch_size=2048, max_batch_tokens=300_000),
+    "azure": dict(max_batch_size=2048, max_batch_tokens=300_000),
+    "gemini": dict(max_batch_size=100, max_batch_tokens=100 * 2048),
+}
+EMBEDDING_MAX_CONCURRENCY = 8
+
+
+def _pack_embedding_batches(
+    token_counts: list[int], max_batch_size: int, max_batch_tokens: int
+) -> list[list[int]]:
+    """Greedily group input indices so each batch stays within both limits."""
+    batches, current, current_tokens = [], [], 0
+    for index, n_tokens in enumerate(token_counts):
+        if current and (
+            len(current) >= max_batch_size or current_tokens + n_tokens > max_batch_tokens
+        ):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += n_tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def _embed_in_batches(
+    embed_batch,
+    texts: list[str],
+    model: str,
+    embedding_dim: int,
+    max_token_size: int,
+    max_batch_size: int,
+    max_batch_tokens: int,
+    encoding_name: str = "cl100k_base",
+    token_limit_margin: float = 1.0,
+) -> np.ndarray:
+    """Embed ``texts`` through the cache, clipping each to ``max_token_size``.
+
+    Tokens are counted with ``encoding_name``, the embedding model's own BPE.
+    For models without a tiktoken encoding the count is only an estimate, so
+    ``token_limit_margin`` scales the limit down to stay under the real one.
+    """
+    embeddings = np.empty((len(texts), embedding_dim), dtype=np.float32)
+    cache = get_embedding_cache(model, embedding_dim)
+    keys = [embedding_cache_key(text) for text in texts]
+    if cache is not None:
+        rows = cache.lookup(keys)
+        hits = rows >= 0
+        if hits.any():
+            embeddings[hits] = cache.get(rows[hits])
+        miss_indices = np.flatnonzero(~hits)
+    else:
+        miss_indices = np.arange(len(texts))
+    record_embedding(len(texts), len(texts) - len(miss_indices))
+
+    # identical texts are embedded once and copied to every position
+    unique_misses = {}
+    for index in miss_indices:
+        unique_misses.setdefault(keys[index], []).append(index)
+    to_embed = [positions[0] for positions in unique_misses.values()]
+    if not to_embed:
+        return embeddings
+
+    encoder = get_tiktoken_encoding(encoding_name)
+    max_token_size = int(max_token_size * token_limit_margin)
+    request_texts, token_counts = [], []
+    all_tokens = encoder.encode_batch(
+        [texts[index] for index in to_embed], num_threads=TOKENIZER_NUM_THREADS
+    )
+    for index, tokens in zip(to_embed, all_tokens):
+        if len(tokens) > max_token_size:
+            # the endpoint rejects over-long inputs, so clip them to the model's limit
+            request_texts.append(encoder.decode(tokens[:max_token_size]))
+        else:
+            request_texts.append(texts[index])
+        token_counts.append(min(len(tokens), max_token_size))
+
+    new_embeddings = np.empty((len(to_embed), embedding_dim), dtype=np.float32)
+    semaphore = asyncio.Semaphore(EMBEDDING_MAX_CONCURRENCY)
+
+    async def _run(batch: list[int]):
+        async with semaphore:
+            new_embeddings[batch] = await embed_batch([request_texts[i] for i in batch])
+
+    batches = _pack_embedding_batches(token_counts, max_batch_size, max_batch_tokens)
+    with span("embed", model=model, texts=len(texts), embedded=len(to_embed), requests=len(batches)):
+        await asyncio.gather(*[_run(batch) for batch in batches])
+    for row, positions in zip(new_embeddings, unique_misses.values()):
+        embeddings[positions] = row
+    if cache is not None:
+        cache.add(list(unique_misses.keys()), new_embeddings)
+    return embeddings
+
+
 @wrap_embedding_func_with_attrs(embedding_dim=1536, max_token_size=8192)
+async def openai_embedding(texts: list[str]) -> np.ndarray:
+    return await _embed_in_batches(
+        _openai_embedding_batch,
+        texts,
+        model="text-embedding-3-small",
+        embedding_dim=1536,
+        max_token_size=8192,
+        **EMBEDDING_BATCH_LIMITS["openai"],
+    )
+
+
 @retry(
     stop=stop_after_attempt(5),
-    wait=wait_exponential(multiplier=1, min=4, max=10),
-    retry=retry_if_exception_type((RateLimitError, APIConnectionError)),
+    wait=wait_random_exponential(multiplier=1, max=10),
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
 )
-async def openai_embedding(texts: list[str]) -> np.ndarray:
+async def _openai_embedding_batch(texts: list[str]) -> np.ndarray:
     openai_async_client = get_openai_async_client_instance()
-    response = await openai_async_client.embeddings.create(
-        model="text-embedding-3-small", input=texts, encoding_format="float"
-    )
-    return np.array([dp.embedding for dp in response.data])
+    async with get_rate_limiter("openai").limit(estimate_tokens(texts)) as usage:
+        response = await openai_async_client.embeddings.create(
+            model="text-embedding-3-small", input=texts, encoding_format="float"
+        )
+        usage.tokens = response.usage.total_tokens if response.usage else None
+    return np.array([dp.embedding for dp in response.data], dtype=np.float32)
 
 
 
 @wrap_embedding_func_with_attrs(embedding_dim=768, max_token_size=2048)
+async def gemini_embedding(texts: list[str]) -> np.ndarray:
+    return await _embed_in_batches(
+        _gemini_embedding_batch,
+        texts,
+        model="text-embedding-004",
+        embedding_dim=768,
+        max_token_size=2048,
+        **EMBEDDING_BATCH_LIMITS["gemini"],
+        # Gemini tokenizes with SentencePiece; cl100k counts run lower on some text
+        token_limit_margin=0.75,
+    )
+
+
 @retry(
     stop=stop_after_attempt(5),
-    wait=wait_exponential(multiplier=1, min=4, max=10),
-    retry=retry_if_exception_type((RateLimitError, APIConnectionError)),
+    wait=wait_random_exponential(multiplier=1, max=10),
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
 )
-async def gemini_embedding(texts: list[str]) -> np.ndarray:
+async def _gemini_embedding_batch(texts: list[str]) -> np.ndarray:
     gemini_async_client = get_gemini_async_client_instance()
-    response = await gemini_async_client.embeddings.create(
-        model="text-embedding-004", input=texts, encoding_format="float"
-    )
-    return np.array([dp.embedding for dp in response.data])
+    async with get_rate_limiter("gemini").limit(estimate_tokens(texts)) as usage:
+        response = await gemini_async_client.embeddings.create(
+            model="text-embedding-004", input=texts, encoding_format="float"
+        )
+        usage.tokens = response.usage.total_tokens if response.usage else None
+    return np.array([dp.embedding for dp in response.data], dtype=np.float32)
 
 
 
 @retry(
     stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=4, max=10),
-    retry=retry_if_exception_type((RateLimitError, APIConnectionError)),
+    wait=wait_random_exponential(multiplier=1, max=10),
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
 )
 async def azure_openai_complete_if_cache(
     deployment_name, prompt, system_prompt=None, history_messages=[], **kwargs
@@ -185,28 +518,10 @@ async def azure_openai_complete_if_cache(
         messages.append({"role": "system", "content": system_prompt})
     messages.extend(history_messages)
     messages.append({"role": "user", "content": prompt})
-    if hashing_kv is not None:
-        args_hash = compute_args_hash(deployment_name, messages)
-        if_cache_return = await hashing_kv.get_by_id(args_hash)
-        if if_cache_return is not None:
-            return if_cache_return["return"]
-
-    response = await azure_openai_client.chat.completions.create(
-        model=deployment_name, messages=messages, **kwargs
+    return await _chat_complete(
+        "azure", azure_openai_client, deployment_name, messages, hashing_kv, **kwargs
     )
 
-    if hashing_kv is not None:
-        await hashing_kv.upsert(
-            {
-                args_hash: {
-                    "return": response.choices[0].message.content,
-                    "model": deployment_name,
-                }
-            }
-        )
-        await hashing_kv.index_done_callback()
-    return response.choices[0].message.content
-
 
 async def azure_gpt_4o_complete(
     prompt, system_prompt=None, history_messages=[], **kwargs
@@ -233,14 +548,27 @@ async def azure_gpt_4o_mini_complete(
 
 
 @wrap_embedding_func_with_attrs(embedding_dim=1536, max_token_size=8192)
+async def azure_openai_embedding(texts: list[str]) -> np.ndarray:
+    return await _embed_in_batches(
+        _azure_openai_embedding_batch,
+        texts,
+        model="azure-text-embedding-3-small",
+        embedding_dim=1536,
+        max_token_size=8192,
+        **EMBEDDING_BATCH_LIMITS["azure"],
+    )
+
+
 @retry(
     stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=4, max=10),
-    retry=retry_if_exception_type((RateLimitError, APIConnectionError)),
+    wait=wait_random_exponential(multiplier=1, max=10),
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
 )
-async def azure_openai_embedding(texts: list[str]) -> np.ndarray:
+async def _azure_openai_embedding_batch(texts: list[str]) -> np.ndarray:
     azure_openai_client = get_azure_openai_async_client_instance()
-    response = await azure_openai_client.embeddings.create(
-        model="text-embedding-3-small", input=texts, encoding_format="float"
-    )
-    return np.array([dp.embedding for dp in response.data])
+    async with get_rate_limiter("azure").limit(estimate_tokens(texts)) as usage:
+        response = await azure_openai_client.embeddings.create(
+            model="text-embedding-3-small", input=texts, encoding_format="float"
+        )
+        usage.tokens = response.usage.total_tokens if response.usage else None
+    return np.array([dp.embedding for dp in response.data], dtype=np.float32)
@@ -0,0 +1,126 @@
+import json
+import threading
+import contextvars
+from time import perf_counter
+
+from ._trace import span
+
+# Innermost stage of the current task; LLM and embedding calls are charged to it.
+_current_stage = contextvars.ContextVar("videorag_stage", default=None)
+
+_COUNTERS = (
+    "calls",
+    "seconds_total",
+    "seconds_max",
+    "llm_calls",
+    "llm_cache_hits",
+    "prompt_tokens",
+    "completion_tokens",
+    "embedding_texts",
+    "embedding_cache_hits",
+)
+
+_PROMETHEUS_HELP = {
+    "calls": ("videorag_stage_calls_total", "counter", "Times the stage ran."),
+    "seconds_total": ("videorag_stage_seconds_total", "counter", "Wall time spent in the stage, summed over concurrent runs."),
+    "seconds_max": ("videorag_stage_seconds_max", "gauge", "Longest single run of the stage."),
+    "llm_calls": ("videorag_llm_calls_total", "counter", "LLM requests sent to the provider."),
+    "llm_cache_hits": ("videorag_llm_cache_hits_total", "counter", "LLM calls answered from the response cache."),
+    "prompt_tokens": ("videorag_llm_prompt_tokens_total", "counter", "Prompt tokens billed by the provider."),
+    "completion_tokens": ("videorag_llm_completion_tokens_total", "counter", "Completion tokens billed by the provider."),
+    "embedding_texts": ("videorag_embedding_texts_total", "counter", "Texts passed to the embedding function."),
+    "embedding_cache_hits": ("videorag_embedding_cache_hits_total", "counter", "Texts served from the embedding cache."),
+}
+
+_stats: dict[str, dict] = {}
+_stats_lock = threading.Lock()
+
+
+def _add(stage_name, **values):
+    stage_name = stage_name or "unattributed"
+    with _stats_lock:
+        stats = _stats.get(stage_name)
+        if stats is None:
+            stats = _stats[stage_name] = dict.fromkeys(_COUNTERS, 0)
+        for key, value in values.items():
+            if key == "seconds_max":
+                stats[key] = max(stats[key], value)
+            else:
+                stats[key] += value
+
+
+class stage:
+    """Time a pipeline stage and charge the LLM/embedding calls made inside it.
+
+    Also opens a tracing span of the same name, so ``set()`` on the returned
+    object annotates the span when the query is being traced.
+    """
+
+    __slots__ = ("name", "_span", "_token", "_start")
+
+    def __init__(self, name: str, **attrs):
+        self.name = name
+        self._span = span(name, **attrs)
+
+    def __enter__(self):
+        self._token = _current_stage.set(self.name)
+        self._start = perf_counter()
+        return self._span.__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = perf_counter() - self._start
+        _current_stage.reset(self._token)
+        _add(self.name, calls=1, seconds_total=elapsed, seconds_max=elapsed)
+        return self._span.__exit__(exc_type, exc, tb)
+
+
+def record_llm_call(prompt_tokens: int = 0, completion_tokens: int = 0, cached: bool = False):
+    if cached:
+        _add(_current_stage.get(), llm_cache_hits=1)
+    else:
+        _add(
+            _current_stage.get(),
+            llm_calls=1,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+        )
+
+
+def record_embedding(texts: int, cache_hits: int):
+    _add(_current_stage.get(), embedding_texts=texts, embedding_cache_hits=cache_hits)
+
+
+def reset_metrics():
+    with _stats_lock:
+        _stats.clear()
+
+
+def metrics_snapshot() -> dict:
+    """Per-stage counters plus derived cache hit rates."""
+    with _stats_lock:
+        snapshot = {name: dict(stats) for name, stats in _stats.items()}
+    for stats in snapshot.values():
+        llm_lookups = stats["llm_calls"] + stats["llm_cache_hits"]
+        stats["llm_cache_hit_rate"] = stats["llm_cache_hits"] / llm_lookups if llm_lookups else None
+        stats["embedding_cache_hit_rate"] = (
+            stats["embedding_cache_hits"] / stats["embedding_texts"] if stats["embedding_texts"] else None
+        )
+    return snapshot
+
+
+def export_metrics_json(indent: int = None) -> str:
+    return json.dumps(metrics_snapshot(), indent=indent)
+
+
+def export_metrics_prometheus() -> str:
+    """Prometheus text exposition format, one labelled series per stage."""
+    snapshot = metrics_snapshot()
+    lines = []
+    for counter in _COUNTERS:
+        metric, metric_type, help_text = _PROMETHEUS_HELP[counter]
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {metric_type}")
+        for stage_name, stats in sorted(snapshot.items()):
+            label = stage_name.replace("\\", "\\\\").replace('"', '\\"')
+            lines.append(f'{metric}{{stage="{label}"}} {stats[counter]}')
+    return "\n".join(lines) + "\n"
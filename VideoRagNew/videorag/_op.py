@@ -1,17 +1,18 @@
+import os
 import re
 import json
 import openai
 import asyncio
-import tiktoken
+import logging
+import numpy as np
+from bisect import bisect_left, bisect_right
+from itertools import accumulate, chain
 from typing import Union
 from collections import Counter, defaultdict
 from ._splitter import SeparatorSplitter
 from ._utils import (
     logger,
-    clean_str,
     compute_mdhash_id,
-    decode_tokens_by_tiktoken,
-    encode_string_by_tiktoken,
     is_float_regex,
     list_of_list_to_csv,
     pack_user_ass_to_openai_messages,
@@ -28,6 +29,11 @@ from .base import (
     QueryParam,
 )
 from .prompt import GRAPH_FIELD_SEP, PROMPTS
+from ._tokenizer import TOKENIZER_NUM_THREADS, get_tiktoken_encoder
+from ._extraction_parser import parse_extraction_records
+from ._graph_bulk import get_edges, get_nodes, upsert_edges, upsert_nodes
+from ._metrics import stage
+from ._trace import trace
 from ._videoutil import (
     retrieved_segment_caption,
 )
@@ -71,52 +77,42 @@ def chunking_by_video_segments(
     tiktoken_model,
     max_token_size=1024,
 ):
-    # make sure each segment is not larger than max_token_size
-    for index in range(len(tokens_list)):
-        if len(tokens_list[index]) > max_token_size:
-            tokens_list[index] = tokens_list[index][:max_token_size]
-    
-    results = []
-    chunk_token = []
-    chunk_segment_ids = []
-    chunk_order_index = 0
-    for index, tokens in enumerate(tokens_list):
-        
-        if len(chunk_token) + len(tokens) <= max_token_size:
-            # add new segment
-            chunk_token += tokens.copy()
-            chunk_segment_ids.append(doc_keys[index])
-        else:
-            # save the current chunk
-            chunk = tiktoken_model.decode(chunk_token)
-            results.append(
-                {
-                    "tokens": len(chunk_token),
-                    "content": chunk.strip(),
-                    "chunk_order_index": chunk_order_index,
-                    "video_segment_id": chunk_segment_ids,
-                }
-            )
-            # new chunk with current segment as begin
-            chunk_token = []
-            chunk_segment_ids = []
-            chunk_token += tokens.copy()
-            chunk_segment_ids.append(doc_keys[index])
-            chunk_order_index += 1
-    
-    # save the last chunk
-    if len(chunk_token) > 0:
-        chunk = tiktoken_model.decode(chunk_token)
-        results.append(
-            {
-                "tokens": len(chunk_token),
-                "content": chunk.strip(),
-                "chunk_order_index": chunk_order_index,
-                "video_segment_id": chunk_segment_ids,
-            }
+    # make sure each segment is not larger than max_token_size (without touching the caller's lists)
+    segments = [
+        tokens[:max_token_size] if len(tokens) > max_token_size else tokens
+        for tokens in tokens_list
+    ]
+    prefix = [0, *accumulate(len(tokens) for tokens in segments)]
+
+    # greedy packing planned on the prefix sums: a chunk takes segments while the total fits
+    boundaries = []
+    start = 0
+    while start < len(segments):
+        end = bisect_right(prefix, prefix[start] + max_token_size) - 1
+        boundaries.append((start, max(end, start + 1)))
+        start = boundaries[-1][1]
+    if boundaries and prefix[boundaries[-1][1]] == prefix[boundaries[-1][0]]:
+        # the last chunk is dropped when it has no tokens at all
+        boundaries.pop()
+
+    # single-segment chunks decode the segment as-is, others are joined once
+    chunks = [
+        tiktoken_model.decode(
+            segments[start]
+            if end - start == 1
+            else list(chain.from_iterable(segments[start:end]))
         )
-    
-    return results
+        for start, end in boundaries
+    ]
+    return [
+        {
+            "tokens": prefix[end] - prefix[start],
+            "content": chunk.strip(),
+            "chunk_order_index": chunk_order_index,
+            "video_segment_id": doc_keys[start:end],
+        }
+        for chunk_order_index, ((start, end), chunk) in enumerate(zip(boundaries, chunks))
+    ]
     
     
 def chunking_by_seperators(
@@ -155,32 +151,128 @@ def chunking_by_seperators(
     return results
 
 
-def get_chunks(new_videos, chunk_func=chunking_by_video_segments, **chunk_func_params):
-    inserting_chunks = {}
-
-    new_videos_list = list(new_videos.keys())
-    for video_name in new_videos_list:
-        segment_id_list = list(new_videos[video_name].keys())
-        docs = [new_videos[video_name][index]["content"] for index in segment_id_list]
+def _separator_cut_points(tokens: list[int], separators: list[list[int]]) -> list[int]:
+    """Positions right after every occurrence of a separator token sequence."""
+    by_first_token = defaultdict(list)
+    for separator in separators:
+        if separator:
+            by_first_token[separator[0]].append(separator)
+    cut_points = set()
+    for position, token in enumerate(tokens):
+        for separator in by_first_token.get(token, ()):
+            if tokens[position : position + len(separator)] == separator:
+                cut_points.add(position + len(separator))
+    return sorted(cut_points)
 
-        print(f"Extracted text from {video_name}: {docs}")
 
-        doc_keys = [f'{video_name}_{index}' for index in segment_id_list]
+def chunking_by_video_segments_with_overlap(
+    tokens_list: list[list[int]],
+    doc_keys,
+    tiktoken_model,
+    overlap_token_size=128,
+    max_token_size=1024,
+    split_on_separators=True,
+):
+    """Fill chunks up to max_token_size across segment edges, with overlap.
 
-        ENCODER = tiktoken.encoding_for_model("gpt-4o")
+    Each chunk ends on the last segment boundary in its second half if there is
+    one, else on the last SeparatorSplitter separator, else at max_token_size.
+    Only chunks cut inside a segment overlap the next one, so chunks stay close
+    to full without repeating whole segments.
+    ``video_segment_id`` lists every segment the chunk touches and
+    ``video_segment_spans`` gives each one's token range inside the chunk.
+    Use it with ``functools.partial`` to change the overlap, e.g.
+    ``VideoRAG(chunk_func=partial(chunking_by_video_segments_with_overlap, overlap_token_size=64))``.
+    """
+    if not 0 <= overlap_token_size < max_token_size:
+        # a larger overlap would move the next chunk's start backwards and never finish
+        raise ValueError(
+            f"overlap_token_size must be in [0, max_token_size), got {overlap_token_size} with max_token_size {max_token_size}"
+        )
+    flat_tokens = list(chain.from_iterable(tokens_list))
+    prefix = [0, *accumulate(len(tokens) for tokens in tokens_list)]
+    separator_cuts = []
+    if split_on_separators:
+        separator_cuts = _separator_cut_points(
+            flat_tokens,
+            [tiktoken_model.encode(s) for s in PROMPTS["default_text_separator"]],
+        )
 
+    results = []
+    start = 0
+    while start < len(flat_tokens):
+        limit = start + max_token_size
+        if limit >= len(flat_tokens):
+            end = len(flat_tokens)
+        else:
+            end = limit
+            segment_cut = prefix[bisect_right(prefix, limit) - 1]
+            separator_index = bisect_right(separator_cuts, limit) - 1
+            if segment_cut > start + max_token_size // 2:
+                end = segment_cut
+            elif separator_index >= 0 and separator_cuts[separator_index] > start + overlap_token_size:
+                end = separator_cuts[separator_index]
 
-        tokens = ENCODER.encode_batch(docs, num_threads=16)
-        print(f"Tokenized text for {video_name}: {tokens}")
-        chunks = chunk_func(
-            tokens, doc_keys=doc_keys, tiktoken_model=ENCODER, **chunk_func_params
+        # segments overlapping [start, end); empty segments carry no tokens and are skipped
+        segment_ids, segment_spans = [], []
+        for index in range(bisect_right(prefix, start) - 1, bisect_left(prefix, end)):
+            if prefix[index + 1] > prefix[index]:
+                segment_ids.append(doc_keys[index])
+                segment_spans.append(
+                    [max(prefix[index], start) - start, min(prefix[index + 1], end) - start]
+                )
+        results.append(
+            {
+                "tokens": end - start,
+                "content": tiktoken_model.decode(flat_tokens[start:end]).strip(),
+                "chunk_order_index": len(results),
+                "video_segment_id": segment_ids,
+                "video_segment_spans": segment_spans,
+            }
         )
+        if end == len(flat_tokens):
+            break
+        # overlap only where a segment was cut in the middle
+        on_segment_edge = prefix[bisect_left(prefix, end)] == end
+        start = end if on_segment_edge else max(end - overlap_token_size, start + 1)
+    return results
+
 
-        for chunk in chunks:
-            inserting_chunks.update(
-                {compute_mdhash_id(chunk["content"], prefix="chunk-"): chunk}
+def get_chunks(new_videos, chunk_func=chunking_by_video_segments, **chunk_func_params):
+    with stage("get_chunks", videos=len(new_videos)):
+        inserting_chunks = {}
+
+        new_videos_list = list(new_videos.keys())
+        segment_id_lists = [list(new_videos[video_name].keys()) for video_name in new_videos_list]
+        docs = [
+            new_videos[video_name][index]["content"]
+            for video_name, segment_id_list in zip(new_videos_list, segment_id_lists)
+            for index in segment_id_list
+        ]
+
+        # tokenize every segment of every video in one threaded call
+        ENCODER = get_tiktoken_encoder("gpt-4o")
+        all_tokens = ENCODER.encode_batch(docs, num_threads=TOKENIZER_NUM_THREADS)
+
+        offset = 0
+        for video_name, segment_id_list in zip(new_videos_list, segment_id_lists):
+            n_segments = len(segment_id_list)
+            tokens = all_tokens[offset : offset + n_segments]
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Extracted text from {video_name}: {docs[offset : offset + n_segments]}")
+                logger.debug(f"Tokenized text for {video_name}: {tokens}")
+            offset += n_segments
+
+            doc_keys = [f'{video_name}_{index}' for index in segment_id_list]
+            chunks = chunk_func(
+                tokens, doc_keys=doc_keys, tiktoken_model=ENCODER, **chunk_func_params
             )
 
+            for chunk in chunks:
+                inserting_chunks.update(
+                    {compute_mdhash_id(chunk["content"], prefix="chunk-"): chunk}
+                )
+
     return inserting_chunks
 
 
@@ -194,13 +286,12 @@ async def _handle_entity_relation_summary(
     tiktoken_model_name = global_config["tiktoken_model_name"]
     summary_max_tokens = global_config["entity_summary_to_max_tokens"]
 
-    tokens = encode_string_by_tiktoken(description, model_name=tiktoken_model_name)
+    encoder = get_tiktoken_encoder(tiktoken_model_name)
+    tokens = encoder.encode(description)
     if len(tokens) < summary_max_tokens:  # No need for summary
         return description
     prompt_template = PROMPTS["summarize_entity_descriptions"]
-    use_description = decode_tokens_by_tiktoken(
-        tokens[:llm_max_tokens], model_name=tiktoken_model_name
-    )
+    use_description = encoder.decode(tokens[:llm_max_tokens])
     context_base = dict(
         entity_name=entity_or_relation_name,
         description_list=use_description.split(GRAPH_FIELD_SEP),
@@ -211,153 +302,250 @@ async def _handle_entity_relation_summary(
     return summary
 
 
-async def _handle_single_entity_extraction(
-    record_attributes: list[str],
-    chunk_key: str,
-):
-    if len(record_attributes) < 4 or record_attributes[0] != '"entity"':
-        return None
-    # add this record as a node in the G
-    entity_name = clean_str(record_attributes[1].upper())
-    if not entity_name.strip():
-        return None
-    entity_type = clean_str(record_attributes[2].upper())
-    entity_description = clean_str(record_attributes[3])
-    entity_source_id = chunk_key
-    return dict(
-        entity_name=entity_name,
-        entity_type=entity_type,
-        description=entity_description,
-        source_id=entity_source_id,
-    )
+BATCH_SUMMARIZE_DESCRIPTIONS_PROMPT = """---Role---
+You are a helpful assistant responsible for generating comprehensive summaries of the data provided below.
 
+---Items---
+{items}
 
-async def _handle_single_relationship_extraction(
-    record_attributes: list[str],
-    chunk_key: str,
-):
-    if len(record_attributes) < 5 or record_attributes[0] != '"relationship"':
-        return None
-    # add this record as edge
-    source = clean_str(record_attributes[1].upper())
-    target = clean_str(record_attributes[2].upper())
-    edge_description = clean_str(record_attributes[3])
-    edge_source_id = chunk_key
-    weight = (
-        float(record_attributes[-1]) if is_float_regex(record_attributes[-1]) else 1.0
-    )
-    return dict(
-        src_id=source,
-        tgt_id=target,
-        weight=weight,
-        description=edge_description,
-        source_id=edge_source_id,
-    )
+---Task---
+Each numbered item is an entity, or a pair of entities for a relationship, followed by a list of its descriptions.
+For every item, concatenate all of its descriptions into a single, comprehensive description written in third person.
+If the descriptions are contradictory, resolve the contradictions and provide a single, coherent summary, including the entity names for full context.
+Return only a JSON object mapping each item number to its summary, for example {{"1": "...", "2": "..."}}.
+"""
+
+async def _summarize_descriptions(
+    items: list[tuple[Union[str, tuple[str, str]], str]],
+    global_config: dict,
+) -> list[str]:
+    """Summarize every merged description that is too long, several per LLM call.
+
+    Descriptions shorter than ``entity_summary_to_max_tokens`` come back
+    unchanged. The rest are clipped to ``cheap_model_max_token_size`` as in
+    ``_handle_entity_relation_summary`` and packed, at most
+    ``entity_summary_batch_size`` per prompt, within that same token budget.
+    Items a reply leaves out are summarized one at a time.
+    """
+    use_llm_func: callable = global_config["cheap_model_func"]
+    llm_max_tokens = global_config["cheap_model_max_token_size"]
+    summary_max_tokens = global_config["entity_summary_to_max_tokens"]
+    batch_size = global_config.get("entity_summary_batch_size", 10)
+    encoder = get_tiktoken_encoder(global_config["tiktoken_model_name"])
+
+    results = [description for _, description in items]
+    all_tokens = encoder.encode_batch(results, num_threads=TOKENIZER_NUM_THREADS)
+    oversize = [i for i, tokens in enumerate(all_tokens) if len(tokens) >= summary_max_tokens]
+    if not oversize:
+        return results
+
+    entries = {}
+    prompt_budget = llm_max_tokens - len(encoder.encode(BATCH_SUMMARIZE_DESCRIPTIONS_PROMPT))
+    batches, batch, batch_tokens = [], [], 0
+    for i in oversize:
+        tokens = all_tokens[i]
+        use_description = results[i] if len(tokens) <= llm_max_tokens else encoder.decode(tokens[:llm_max_tokens])
+        entries[i] = f"{items[i][0]}\n{use_description.split(GRAPH_FIELD_SEP)}"
+        # the item header and list markup add a few tokens on top of the description
+        entry_tokens = min(len(tokens), llm_max_tokens) + 16
+        if batch and (len(batch) >= batch_size or batch_tokens + entry_tokens > prompt_budget):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += entry_tokens
+    batches.append(batch)
+
+    async def _summarize_batch(batch: list[int]) -> dict[int, str]:
+        if len(batch) == 1:
+            i = batch[0]
+            return {i: await _handle_entity_relation_summary(items[i][0], items[i][1], global_config)}
+        summary_prompt = BATCH_SUMMARIZE_DESCRIPTIONS_PROMPT.format(
+            items="\n\n".join(f"[{n}] {entries[i]}" for n, i in enumerate(batch, start=1))
+        )
+        result = await use_llm_func(summary_prompt, max_tokens=summary_max_tokens * len(batch))
+        try:
+            summaries = dict(json.loads(re.search(r"\{.*\}", result, re.DOTALL).group(0)))
+        except (AttributeError, TypeError, ValueError):
+            logger.warning("Batch summary reply was not valid JSON, summarizing one by one")
+            summaries = {}
+        done, missing = {}, []
+        for n, i in enumerate(batch, start=1):
+            summary = summaries.get(str(n))
+            if isinstance(summary, str) and summary.strip():
+                done[i] = summary.strip()
+            else:
+                missing.append(i)
+        fallback = await asyncio.gather(
+            *[_handle_entity_relation_summary(items[i][0], items[i][1], global_config) for i in missing]
+        )
+        done.update(zip(missing, fallback))
+        return done
+
+    with stage("extract_entities.summarize", descriptions=len(oversize), calls=len(batches)):
+        for done in await asyncio.gather(*[_summarize_batch(batch) for batch in batches]):
+            for i, summary in done.items():
+                results[i] = summary
+    return results
 
 
 async def _merge_nodes_then_upsert(
-    entity_name: str,
-    nodes_data: list[dict],
+    maybe_nodes: dict[str, list[dict]],
     knowledge_graph_inst: BaseGraphStorage,
     global_config: dict,
+    summarize: bool = True,
 ):
-    already_entitiy_types = []
-    already_source_ids = []
-    already_description = []
-
-    already_node = await knowledge_graph_inst.get_node(entity_name)
-    if already_node is not None:
-        already_entitiy_types.append(already_node["entity_type"])
-        already_source_ids.extend(
-            split_string_by_multi_markers(already_node["source_id"], [GRAPH_FIELD_SEP])
+    """Merge new records into their nodes; with ``summarize=False`` descriptions are only joined.
+
+    Records from a chunk the node already lists as a source are skipped, so
+    replaying a checkpointed batch does not merge it twice. An empty record
+    list re-merges (and summarizes) the stored node as it is.
+    """
+    entity_names = list(maybe_nodes.keys())
+    already_nodes = await get_nodes(knowledge_graph_inst, entity_names)
+
+    merged = []
+    for entity_name, already_node in zip(entity_names, already_nodes):
+        nodes_data = maybe_nodes[entity_name]
+        if already_node is None and not nodes_data:
+            continue
+        already_entitiy_types = []
+        already_source_ids = []
+        already_description = []
+        if already_node is not None:
+            already_entitiy_types.append(already_node["entity_type"])
+            already_source_ids.extend(
+                split_string_by_multi_markers(already_node["source_id"], [GRAPH_FIELD_SEP])
+            )
+            already_description.append(already_node["description"])
+            new_nodes_data = [dp for dp in nodes_data if dp["source_id"] not in already_source_ids]
+            if nodes_data and not new_nodes_data:
+                continue
+            nodes_data = new_nodes_data
+
+        entity_type = sorted(
+            Counter(
+                [dp["entity_type"] for dp in nodes_data] + already_entitiy_types
+            ).items(),
+            key=lambda x: x[1],
+            reverse=True,
+        )[0][0]
+        description = GRAPH_FIELD_SEP.join(
+            sorted(set([dp["description"] for dp in nodes_data] + already_description))
         )
-        already_description.append(already_node["description"])
-
-    entity_type = sorted(
-        Counter(
-            [dp["entity_type"] for dp in nodes_data] + already_entitiy_types
-        ).items(),
-        key=lambda x: x[1],
-        reverse=True,
-    )[0][0]
-    description = GRAPH_FIELD_SEP.join(
-        sorted(set([dp["description"] for dp in nodes_data] + already_description))
-    )
-    source_id = GRAPH_FIELD_SEP.join(
-        set([dp["source_id"] for dp in nodes_data] + already_source_ids)
-    )
-    description = await _handle_entity_relation_summary(
-        entity_name, description, global_config
-    )
-    node_data = dict(
-        entity_type=entity_type,
-        description=description,
-        source_id=source_id,
-    )
-    await knowledge_graph_inst.upsert_node(
-        entity_name,
-        node_data=node_data,
-    )
-    node_data["entity_name"] = entity_name
-    return node_data
+        source_id = GRAPH_FIELD_SEP.join(
+            set([dp["source_id"] for dp in nodes_data] + already_source_ids)
+        )
+        merged.append((entity_name, entity_type, description, source_id))
+
+    descriptions = [description for _, _, description, _ in merged]
+    if summarize:
+        descriptions = await _summarize_descriptions(
+            [(entity_name, description) for entity_name, _, description, _ in merged],
+            global_config,
+        )
+    entity_names = [entity_name for entity_name, _, _, _ in merged]
+    all_nodes_data = [
+        dict(entity_type=entity_type, description=description, source_id=source_id)
+        for (_, entity_type, _, source_id), description in zip(merged, descriptions)
+    ]
+    await upsert_nodes(knowledge_graph_inst, list(zip(entity_names, all_nodes_data)))
+    return [
+        dict(node_data, entity_name=entity_name)
+        for entity_name, node_data in zip(entity_names, all_nodes_data)
+    ]
 
 
 async def _merge_edges_then_upsert(
-    src_id: str,
-    tgt_id: str,
-    edges_data: list[dict],
+    maybe_edges: dict[tuple[str, str], list[dict]],
     knowledge_graph_inst: BaseGraphStorage,
     global_config: dict,
+    summarize: bool = True,
 ):
-    already_weights = []
-    already_source_ids = []
-    already_description = []
-    already_order = []
-    if await knowledge_graph_inst.has_edge(src_id, tgt_id):
-        already_edge = await knowledge_graph_inst.get_edge(src_id, tgt_id)
-        already_weights.append(already_edge["weight"])
-        already_source_ids.extend(
-            split_string_by_multi_markers(already_edge["source_id"], [GRAPH_FIELD_SEP])
+    """Edge counterpart of ``_merge_nodes_then_upsert``, with the same replay and summary rules."""
+    edge_keys = list(maybe_edges.keys())
+    already_edges = await get_edges(knowledge_graph_inst, edge_keys)
+
+    merged = []
+    for (src_id, tgt_id), already_edge in zip(edge_keys, already_edges):
+        edges_data = maybe_edges[(src_id, tgt_id)]
+        if already_edge is None and not edges_data:
+            continue
+        already_weights = []
+        already_source_ids = []
+        already_description = []
+        already_order = []
+        if already_edge is not None:
+            already_weights.append(already_edge["weight"])
+            already_source_ids.extend(
+                split_string_by_multi_markers(already_edge["source_id"], [GRAPH_FIELD_SEP])
+            )
+            already_description.append(already_edge["description"])
+            already_order.append(already_edge.get("order", 1))
+            new_edges_data = [dp for dp in edges_data if dp["source_id"] not in already_source_ids]
+            if edges_data and not new_edges_data:
+                continue
+            edges_data = new_edges_data
+
+        # [numberchiffre]: `Relationship.order` is only returned from DSPy's predictions
+        order = min([dp.get("order", 1) for dp in edges_data] + already_order)
+        weight = sum([dp["weight"] for dp in edges_data] + already_weights)
+        description = GRAPH_FIELD_SEP.join(
+            sorted(set([dp["description"] for dp in edges_data] + already_description))
         )
-        already_description.append(already_edge["description"])
-        already_order.append(already_edge.get("order", 1))
-
-    # [numberchiffre]: `Relationship.order` is only returned from DSPy's predictions
-    order = min([dp.get("order", 1) for dp in edges_data] + already_order)
-    weight = sum([dp["weight"] for dp in edges_data] + already_weights)
-    description = GRAPH_FIELD_SEP.join(
-        sorted(set([dp["description"] for dp in edges_data] + already_description))
-    )
-    source_id = GRAPH_FIELD_SEP.join(
-        set([dp["source_id"] for dp in edges_data] + already_source_ids)
-    )
-    for need_insert_id in [src_id, tgt_id]:
-        if not (await knowledge_graph_inst.has_node(need_insert_id)):
-            await knowledge_graph_inst.upsert_node(
+        source_id = GRAPH_FIELD_SEP.join(
+            set([dp["source_id"] for dp in edges_data] + already_source_ids)
+        )
+        merged.append((src_id, tgt_id, order, weight, description, source_id))
+
+    # endpoints that are not in the graph yet get a placeholder node from their first edge
+    missing_nodes = {}
+    for src_id, tgt_id, _, _, description, source_id in merged:
+        for need_insert_id in (src_id, tgt_id):
+            missing_nodes.setdefault(
                 need_insert_id,
-                node_data={
+                {
                     "source_id": source_id,
                     "description": description,
                     "entity_type": '"UNKNOWN"',
                 },
             )
-    description = await _handle_entity_relation_summary(
-        (src_id, tgt_id), description, global_config
-    )
-    await knowledge_graph_inst.upsert_edge(
-        src_id,
-        tgt_id,
-        edge_data=dict(
-            weight=weight, description=description, source_id=source_id, order=order
-        ),
+    endpoint_ids = list(missing_nodes.keys())
+    existing = await get_nodes(knowledge_graph_inst, endpoint_ids)
+    await upsert_nodes(
+        knowledge_graph_inst,
+        [
+            (node_id, missing_nodes[node_id])
+            for node_id, node in zip(endpoint_ids, existing)
+            if node is None
+        ],
     )
-    return_edge_data = dict(
-        src_tgt=(src_id, tgt_id),
-        description=description,
-        weight=weight
+
+    descriptions = [description for _, _, _, _, description, _ in merged]
+    if summarize:
+        descriptions = await _summarize_descriptions(
+            [((src_id, tgt_id), description) for src_id, tgt_id, _, _, description, _ in merged],
+            global_config,
+        )
+    await upsert_edges(
+        knowledge_graph_inst,
+        [
+            (
+                src_id,
+                tgt_id,
+                dict(weight=weight, description=description, source_id=source_id, order=order),
+            )
+            for (src_id, tgt_id, order, weight, _, source_id), description in zip(merged, descriptions)
+        ],
     )
-    return return_edge_data
+    return [
+        dict(src_tgt=(src_id, tgt_id), description=description, weight=weight)
+        for (src_id, tgt_id, _, weight, _, _), description in zip(merged, descriptions)
+    ]
+
 
+GLEAN_STOP_INSTRUCTION = """
+If nothing was missed, output only {completion_delimiter}.
+"""
 
 async def extract_entities(
     chunks: dict[str, TextChunkSchema],
@@ -377,69 +565,68 @@ async def extract_entities(
         completion_delimiter=PROMPTS["DEFAULT_COMPLETION_DELIMITER"],
         entity_types=",".join(PROMPTS["DEFAULT_ENTITY_TYPES"]),
     )
-    continue_prompt = PROMPTS["entiti_continue_extraction"]
-    if_loop_prompt = PROMPTS["entiti_if_loop_extraction"]
+    # one call both adds missed records and says whether anything was missed
+    glean_prompt = PROMPTS["entiti_continue_extraction"] + GLEAN_STOP_INSTRUCTION.format(
+        completion_delimiter=context_base["completion_delimiter"]
+    )
+    glean_min_tokens = global_config.get("entity_extract_glean_min_tokens", 200)
+    glean_min_entities = global_config.get("entity_extract_glean_min_entities", 3)
+    glean_budget = global_config.get("entity_extract_glean_budget")
+    # round -> [calls, records added]; "skipped_*" -> chunks that were not gleaned
+    glean_stats = defaultdict(lambda: [0, 0])
+    glean_calls = 0
+
+    delimiters = dict(
+        tuple_delimiter=context_base["tuple_delimiter"],
+        record_delimiter=context_base["record_delimiter"],
+        completion_delimiter=context_base["completion_delimiter"],
+    )
 
     already_processed = 0
     already_entities = 0
     already_relations = 0
 
     async def _process_single_content(chunk_key_dp: tuple[str, TextChunkSchema]):
-        nonlocal already_processed, already_entities, already_relations
+        nonlocal already_processed, already_entities, already_relations, glean_calls
         chunk_key = chunk_key_dp[0]
         chunk_dp = chunk_key_dp[1]
         content = chunk_dp["content"]
         hint_prompt = entity_extract_prompt.format(**context_base, input_text=content)
-        final_result = await use_llm_func(hint_prompt)
+        with stage("extract_entities.extract"):
+            final_result = await use_llm_func(hint_prompt)
+        # each reply is parsed on its own as it arrives
+        entities, relationships = parse_extraction_records(final_result, chunk_key, **delimiters)
 
         history = pack_user_ass_to_openai_messages(hint_prompt, final_result)
-        for now_glean_index in range(entity_extract_max_gleaning):
-            glean_result = await use_llm_func(continue_prompt, history_messages=history)
-
-            history += pack_user_ass_to_openai_messages(continue_prompt, glean_result)
-            final_result += glean_result
-            if now_glean_index == entity_extract_max_gleaning - 1:
-                break
-
-            if_loop_result: str = await use_llm_func(
-                if_loop_prompt, history_messages=history
-            )
-            if_loop_result = if_loop_result.strip().strip('"').strip("'").lower()
-            if if_loop_result != "yes":
-                break
-
-        records = split_string_by_multi_markers(
-            final_result,
-            [context_base["record_delimiter"], context_base["completion_delimiter"]],
-        )
+        # short chunks and chunks with few entities rarely gain anything from gleaning
+        if entity_extract_max_gleaning and chunk_dp["tokens"] < glean_min_tokens:
+            glean_stats["skipped_short"][0] += 1
+        elif entity_extract_max_gleaning and len(entities) < glean_min_entities:
+            glean_stats["skipped_low_yield"][0] += 1
+        else:
+            with stage("extract_entities.gleaning"):
+                for now_glean_index in range(entity_extract_max_gleaning):
+                    if glean_budget is not None and glean_calls >= glean_budget:
+                        glean_stats["skipped_budget"][0] += 1
+                        break
+                    glean_calls += 1
+                    glean_result = await use_llm_func(glean_prompt, history_messages=history)
 
-        maybe_nodes = defaultdict(list)
-        maybe_edges = defaultdict(list)
-        for record in records:
-            record = re.search(r"\((.*)\)", record)
-            if record is None:
-                continue
-            record = record.group(1)
-            record_attributes = split_string_by_multi_markers(
-                record, [context_base["tuple_delimiter"]]
-            )
-            if_entities = await _handle_single_entity_extraction(
-                record_attributes, chunk_key
-            )
-            if if_entities is not None:
-                maybe_nodes[if_entities["entity_name"]].append(if_entities)
-                continue
+                    glean_entities, glean_relationships = parse_extraction_records(
+                        glean_result, chunk_key, **delimiters
+                    )
+                    added = len(glean_entities) + len(glean_relationships)
+                    glean_stats[now_glean_index + 1][0] += 1
+                    glean_stats[now_glean_index + 1][1] += added
+                    if not added:
+                        break
+                    history += pack_user_ass_to_openai_messages(glean_prompt, glean_result)
+                    entities += glean_entities
+                    relationships += glean_relationships
 
-            if_relation = await _handle_single_relationship_extraction(
-                record_attributes, chunk_key
-            )
-            if if_relation is not None:
-                maybe_edges[(if_relation["src_id"], if_relation["tgt_id"])].append(
-                    if_relation
-                )
         already_processed += 1
-        already_entities += len(maybe_nodes)
-        already_relations += len(maybe_edges)
+        already_entities += len({entity["entity_name"] for entity in entities})
+        already_relations += len({(r["src_id"], r["tgt_id"]) for r in relationships})
         now_ticks = PROMPTS["process_tickers"][
             already_processed % len(PROMPTS["process_tickers"])
         ]
@@ -448,37 +635,128 @@ async def extract_entities(
             end="",
             flush=True,
         )
-        return dict(maybe_nodes), dict(maybe_edges)
+        return dict(entities=entities, relationships=relationships)
 
-    # use_llm_func is wrapped in ascynio.Semaphore, limiting max_async callings
-    results = await asyncio.gather(
-        *[_process_single_content(c) for c in ordered_chunks]
-    )
-    print()  # clear the progress bar
-    maybe_nodes = defaultdict(list)
-    maybe_edges = defaultdict(list)
-    for m_nodes, m_edges in results:
-        for k, v in m_nodes.items():
-            maybe_nodes[k].extend(v)
-        for k, v in m_edges.items():
-            # it's undirected graph
-            maybe_edges[tuple(sorted(k))].extend(v)
-    all_entities_data = await asyncio.gather(
-        *[
-            _merge_nodes_then_upsert(k, v, knowledge_graph_inst, global_config)
-            for k, v in maybe_nodes.items()
+    # only the keys of what this ingest touched stay in memory; their merged
+    # descriptions are summarized and embedded once, after the last batch
+    touched_entities = set()
+    touched_edges = set()
+
+    async def _merge_batch(batch_records: list[dict]):
+        maybe_nodes = defaultdict(list)
+        maybe_edges = defaultdict(list)
+        for records in batch_records:
+            for entity in records["entities"]:
+                maybe_nodes[entity["entity_name"]].append(entity)
+            for relationship in records["relationships"]:
+                # it's undirected graph
+                maybe_edges[tuple(sorted((relationship["src_id"], relationship["tgt_id"])))].append(
+                    relationship
+                )
+        with stage("extract_entities.merge_nodes", entities=len(maybe_nodes)):
+            await _merge_nodes_then_upsert(
+                maybe_nodes, knowledge_graph_inst, global_config, summarize=False
+            )
+        with stage("extract_entities.merge_edges", relations=len(maybe_edges)):
+            await _merge_edges_then_upsert(
+                maybe_edges, knowledge_graph_inst, global_config, summarize=False
+            )
+        touched_entities.update(maybe_nodes)
+        touched_edges.update(maybe_edges)
+
+    # Each merged batch appends one line with its chunks' parsed records. The
+    # graph is only persisted once the insert finishes, so an interrupted run
+    # replays the log into the graph instead of calling the LLM again.
+    progress_path = os.path.join(global_config["working_dir"], "entity_extraction_progress.jsonl")
+    if os.path.exists(progress_path):
+        done_keys = set()
+        with open(progress_path, "rb") as f:
+            complete_size = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # torn by the interruption; later appends must start on a fresh line
+                    break
+                complete_size += len(line)
+                batch = {k: v for k, v in json.loads(line).items() if k in chunks}
+                await _merge_batch(list(batch.values()))
+                done_keys.update(batch)
+        with open(progress_path, "ab") as f:
+            f.truncate(complete_size)
+        logger.info(f"Resuming extraction, {len(done_keys)} chunks already extracted")
+        ordered_chunks = [(k, v) for k, v in ordered_chunks if k not in done_keys]
+
+    def _append_progress(line: str):
+        with open(progress_path, "a") as f:
+            f.write(line + "\n")
+
+    async def _checkpoint(chunk_results: list):
+        await _merge_batch([records for _, records in chunk_results])
+        await asyncio.to_thread(_append_progress, json.dumps(dict(chunk_results)))
+
+    # A bounded queue feeds a fixed pool of workers, and finished chunks are
+    # merged into the graph every `entity_extract_merge_batch_size` chunks, so
+    # neither raw LLM output nor parsed records pile up for the whole video.
+    max_concurrency = global_config.get("entity_extract_max_concurrency", 16)
+    merge_batch_size = global_config.get("entity_extract_merge_batch_size", 64)
+    chunk_queue = asyncio.Queue(maxsize=2 * max_concurrency)
+    result_queue = asyncio.Queue(maxsize=merge_batch_size)
+
+    async def _feed():
+        for chunk_key_dp in ordered_chunks:
+            await chunk_queue.put(chunk_key_dp)
+        for _ in range(max_concurrency):
+            await chunk_queue.put(None)
+
+    async def _work():
+        try:
+            while (chunk_key_dp := await chunk_queue.get()) is not None:
+                await result_queue.put((chunk_key_dp[0], await _process_single_content(chunk_key_dp)))
+        except Exception as e:
+            await result_queue.put(e)
+        else:
+            await result_queue.put(None)
+
+    with stage("extract_entities", chunks=len(ordered_chunks)):
+        tasks = [asyncio.ensure_future(_feed())] + [
+            asyncio.ensure_future(_work()) for _ in range(max_concurrency)
         ]
+        try:
+            finished_workers = 0
+            chunk_results = []
+            while finished_workers < max_concurrency:
+                result = await result_queue.get()
+                if result is None:
+                    finished_workers += 1
+                    continue
+                if isinstance(result, Exception):
+                    raise result
+                chunk_results.append(result)
+                if len(chunk_results) >= merge_batch_size:
+                    await _checkpoint(chunk_results)
+                    chunk_results = []
+            if chunk_results:
+                await _checkpoint(chunk_results)
+        finally:
+            for task in tasks:
+                task.cancel()
+    print()  # clear the progress bar
+    for now_glean_index in range(1, entity_extract_max_gleaning + 1):
+        if now_glean_index in glean_stats:
+            calls, added = glean_stats[now_glean_index]
+            logger.info(f"Gleaning round {now_glean_index}: {calls} calls added {added} records")
+    logger.info(
+        f"Gleaning skipped for {glean_stats['skipped_short'][0]} short chunks, "
+        f"{glean_stats['skipped_low_yield'][0]} low-yield chunks, "
+        f"{glean_stats['skipped_budget'][0]} over budget"
     )
-    all_edges_data = await asyncio.gather(
-        *[
-            _merge_edges_then_upsert(k[0], k[1], v, knowledge_graph_inst, global_config)
-            for k, v in maybe_edges.items()
-        ]
+    # each touched entity and edge is summarized and embedded once per ingest
+    all_entities_data = await _merge_nodes_then_upsert(
+        {entity_name: [] for entity_name in touched_entities}, knowledge_graph_inst, global_config
     )
-    if not len(all_entities_data):
-        logger.warning("Didn't extract any entities, maybe your LLM is not working")
-        return None
-    if entity_vdb is not None:
+    all_edges_data = await _merge_edges_then_upsert(
+        {edge_key: [] for edge_key in touched_edges}, knowledge_graph_inst, global_config
+    )
+    if entity_vdb is not None and len(all_entities_data):
         data_for_vdb = {
             compute_mdhash_id(dp["entity_name"], prefix="ent-"): {
                 "content": dp["entity_name"] + dp["description"],
@@ -487,6 +765,13 @@ async def extract_entities(
             for dp in all_entities_data
         }
         await entity_vdb.upsert(data_for_vdb)
+    if os.path.exists(progress_path):
+        # every chunk is merged; a later re-insert of the same content must extract again
+        os.remove(progress_path)
+
+    if not len(all_entities_data):
+        logger.warning("Didn't extract any entities, maybe your LLM is not working")
+        return None
     return knowledge_graph_inst, all_entities_data, all_edges_data
 
 
@@ -534,10 +819,10 @@ async def _find_most_related_segments_from_entities(
                 "order": index,
                 "relation_counts": relation_counts,
             }
-    if any([v is None for v in all_text_units_lookup.values()]):
+    if any([v["data"] is None for v in all_text_units_lookup.values()]):
         logger.warning("Text chunks are missing, maybe the storage is damaged")
     all_text_units = [
-        {"id": k, **v} for k, v in all_text_units_lookup.items() if v is not None
+        {"id": k, **v} for k, v in all_text_units_lookup.items() if v["data"] is not None
     ]
     sorted_text_units = sorted(
         all_text_units, key=lambda x: -x["relation_counts"]
@@ -572,6 +857,39 @@ async def _refine_visual_retrieval_query(
     final_result = await use_llm_func(query_rewrite_prompt)
     return final_result
 
+COMBINED_QUERY_REWRITE_PROMPT = """You will rewrite the same user query twice, once for each set of instructions below.
+
+---Instructions for "entity_query"---
+{entity_prompt}
+
+---Instructions for "visual_query"---
+{visual_prompt}
+
+Return only a JSON object of the form {{"entity_query": "...", "visual_query": "..."}}.
+"""
+
+async def _refine_retrieval_queries(
+    query,
+    query_param: QueryParam,
+    global_config: dict,
+):
+    """Entity and visual rewrites from one LLM call, falling back to two calls."""
+    use_llm_func: callable = global_config["cheap_model_func"]
+    combined_prompt = COMBINED_QUERY_REWRITE_PROMPT.format(
+        entity_prompt=PROMPTS["query_rewrite_for_entity_retrieval"].format(input_text=query),
+        visual_prompt=PROMPTS["query_rewrite_for_visual_retrieval"].format(input_text=query),
+    )
+    final_result = await use_llm_func(combined_prompt)
+    try:
+        rewrites = json.loads(re.search(r"\{.*\}", final_result, re.DOTALL).group(0))
+        return str(rewrites["entity_query"]), str(rewrites["visual_query"])
+    except (AttributeError, KeyError, TypeError, json.JSONDecodeError):
+        logger.warning("Combined query rewrite was not valid JSON, rewriting separately")
+    return await asyncio.gather(
+        _refine_entity_retrieval_query(query, query_param, global_config),
+        _refine_visual_retrieval_query(query, query_param, global_config),
+    )
+
 async def _extract_keywords_query(
     query,
     query_param: QueryParam,
@@ -583,7 +901,78 @@ async def _extract_keywords_query(
     final_result = await use_llm_func(keywords_prompt)
     return final_result
 
-async def videorag_query(
+BATCH_FILTERING_SEGMENT_PROMPT = """---Role---
+You are judging whether video segments can help answer a question.
+
+---Question---
+{knowledge}
+
+---Segments---
+{segments}
+
+---Task---
+Score every segment from 0 to 10 for how useful its caption is for answering the question; 0 means unrelated.
+Return only a JSON object mapping each segment number to its score, for example {{"1": 8, "2": 0}}.
+"""
+
+async def _filter_segments(
+    knowledge: str,
+    captions: dict[str, str],
+    global_config: dict,
+) -> list[str]:
+    """Keep the segments whose captions are relevant to ``knowledge``.
+
+    Captions are scored ``segment_filter_batch_size`` at a time in one LLM call
+    each; segments scoring below ``segment_filter_min_score`` are dropped. If
+    ``segment_filter_similarity_threshold`` is set, captions whose embedding
+    cosine similarity to the query is below it are dropped before any LLM call.
+    """
+    use_model_func = global_config["best_model_func"]
+    batch_size = global_config.get("segment_filter_batch_size", 10)
+    min_score = global_config.get("segment_filter_min_score", 5)
+    similarity_threshold = global_config.get("segment_filter_similarity_threshold")
+
+    segment_ids = list(captions)
+    if similarity_threshold is not None and segment_ids:
+        embeddings = await global_config["embedding_func"](
+            [knowledge] + [captions[s_id] for s_id in segment_ids]
+        )
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        similarities = embeddings[1:] @ embeddings[0]
+        segment_ids = [
+            s_id for s_id, sim in zip(segment_ids, similarities) if sim >= similarity_threshold
+        ]
+        logger.info(f"Similarity pre-filter kept {len(segment_ids)} of {len(captions)} segments")
+
+    async def _filter_batch(batch: list[str]) -> list[str]:
+        filter_prompt = BATCH_FILTERING_SEGMENT_PROMPT.format(
+            knowledge=knowledge,
+            segments="\n".join(
+                f"[{i}] {captions[s_id]}" for i, s_id in enumerate(batch, start=1)
+            ),
+        )
+        result = await use_model_func(filter_prompt)
+        try:
+            scores = dict(json.loads(re.search(r"\{.*\}", result, re.DOTALL).group(0)))
+        except (AttributeError, TypeError, ValueError):
+            logger.warning("Segment filter reply was not valid JSON, keeping the whole batch")
+            return batch
+        remain = []
+        for i, s_id in enumerate(batch, start=1):
+            score = scores.get(str(i), 0)
+            if is_float_regex(str(score)) and float(score) >= min_score:
+                remain.append(s_id)
+        return remain
+
+    results = await asyncio.gather(
+        *[
+            _filter_batch(segment_ids[i : i + batch_size])
+            for i in range(0, len(segment_ids), batch_size)
+        ]
+    )
+    return [s_id for batch in results for s_id in batch]
+
+async def _build_videorag_system_prompt(
     query,
     entities_vdb,
     text_chunks_db,
@@ -596,66 +985,96 @@ async def videorag_query(
     # caption_tokenizer,
     query_param: QueryParam,
     global_config: dict,
-) -> str:
-    
-    print(f"Using Model Function: {global_config['best_model_func']}")
-    use_model_func = global_config["best_model_func"]
-    query = query
-    print(query)
-    # naive chunks
-    results = await chunks_vdb.query(query, top_k=query_param.top_k)
-    if not len(results):
-        return PROMPTS["fail_response"]
-    chunks_ids = [r["id"] for r in results]
-    chunks = await text_chunks_db.get_by_ids(chunks_ids)
-    print("chunks")
-    print(chunks)
-    maybe_trun_chunks = truncate_list_by_token_size(
-        chunks,
-        key=lambda x: x["content"],
-        max_token_size=query_param.naive_max_token_for_text_unit,
-    )
-    logger.info(f"Truncate {len(chunks)} to {len(maybe_trun_chunks)} chunks")
-    section = "-----New Chunk-----\n".join([c["content"] for c in maybe_trun_chunks])
-    retreived_chunk_context = section
-    
-    # visual retrieval
-    query_for_entity_retrieval = await _refine_entity_retrieval_query(
-        query,
-        query_param,
-        global_config,
-    )
-    entity_results = await entities_vdb.query(query_for_entity_retrieval, top_k=query_param.top_k)
-    entity_retrieved_segments = set()
-    if len(entity_results):
-        node_datas = await asyncio.gather(
-            *[knowledge_graph_inst.get_node(r["entity_name"]) for r in entity_results]
-        )
-        if not all([n is not None for n in node_datas]):
-            logger.warning("Some nodes are missing, maybe the storage is damaged")
-        node_degrees = await asyncio.gather(
-            *[knowledge_graph_inst.node_degree(r["entity_name"]) for r in entity_results]
-        )
-        node_datas = [
-            {**n, "entity_name": k["entity_name"], "rank": d}
-            for k, n, d in zip(entity_results, node_datas, node_degrees)
-            if n is not None
-        ]
-        entity_retrieved_segments = entity_retrieved_segments.union(await _find_most_related_segments_from_entities(
-            global_config["retrieval_topk_chunks"], node_datas, text_chunks_db, knowledge_graph_inst
-        ))
-    
-    # visual retrieval
-    query_for_visual_retrieval = await _refine_visual_retrieval_query(
-        query,
-        query_param,
-        global_config,
+) -> Union[str, None]:
+    """Retrieve, filter and assemble the system prompt; None if nothing was retrieved."""
+    # The naive-chunk branch, the entity branch and the visual branch are
+    # independent; only the two retrieval branches wait on the query rewrites.
+    async def _naive_chunk_retrieval():
+        with stage("query.naive_chunk_retrieval") as stage_span:
+            results = await chunks_vdb.query(query, top_k=query_param.top_k)
+            if not len(results):
+                return None
+            chunks_ids = [r["id"] for r in results]
+            chunks = await text_chunks_db.get_by_ids(chunks_ids)
+            maybe_trun_chunks = truncate_list_by_token_size(
+                chunks,
+                key=lambda x: x["content"],
+                max_token_size=query_param.naive_max_token_for_text_unit,
+            )
+            logger.info(f"Truncate {len(chunks)} to {len(maybe_trun_chunks)} chunks")
+            stage_span.set(retrieved=len(chunks), kept=len(maybe_trun_chunks))
+            return "-----New Chunk-----\n".join([c["content"] for c in maybe_trun_chunks])
+
+    if global_config.get("combined_query_rewrite", True):
+        async def _rewrite():
+            with stage("query.query_rewrite"):
+                return await _refine_retrieval_queries(query, query_param, global_config)
+
+        rewrites = asyncio.ensure_future(_rewrite())
+
+        async def _entity_retrieval_query():
+            return (await rewrites)[0]
+
+        async def _visual_retrieval_query():
+            return (await rewrites)[1]
+    else:
+        async def _entity_retrieval_query():
+            return await _refine_entity_retrieval_query(query, query_param, global_config)
+
+        async def _visual_retrieval_query():
+            return await _refine_visual_retrieval_query(query, query_param, global_config)
+
+    async def _entity_retrieval():
+        query_for_entity_retrieval = await _entity_retrieval_query()
+        with stage("query.entity_retrieval") as stage_span:
+            entity_retrieved_segments = await _entity_retrieved_segments(query_for_entity_retrieval)
+            stage_span.set(segments=len(entity_retrieved_segments))
+        return query_for_entity_retrieval, entity_retrieved_segments
+
+    async def _entity_retrieved_segments(query_for_entity_retrieval):
+        entity_results = await entities_vdb.query(query_for_entity_retrieval, top_k=query_param.top_k)
+        entity_retrieved_segments = set()
+        if len(entity_results):
+            node_datas, node_degrees = await asyncio.gather(
+                asyncio.gather(
+                    *[knowledge_graph_inst.get_node(r["entity_name"]) for r in entity_results]
+                ),
+                asyncio.gather(
+                    *[knowledge_graph_inst.node_degree(r["entity_name"]) for r in entity_results]
+                ),
+            )
+            if not all([n is not None for n in node_datas]):
+                logger.warning("Some nodes are missing, maybe the storage is damaged")
+            node_datas = [
+                {**n, "entity_name": k["entity_name"], "rank": d}
+                for k, n, d in zip(entity_results, node_datas, node_degrees)
+                if n is not None
+            ]
+            entity_retrieved_segments = entity_retrieved_segments.union(await _find_most_related_segments_from_entities(
+                global_config["retrieval_topk_chunks"], node_datas, text_chunks_db, knowledge_graph_inst
+            ))
+        return entity_retrieved_segments
+
+    async def _visual_retrieval():
+        query_for_visual_retrieval = await _visual_retrieval_query()
+        with stage("query.visual_retrieval") as stage_span:
+            segment_results = await video_segment_feature_vdb.query(query_for_visual_retrieval)
+            visual_retrieved_segments = set()
+            if len(segment_results):
+                for n in segment_results:
+                    visual_retrieved_segments.add(n['__id__'])
+            stage_span.set(segments=len(visual_retrieved_segments))
+        return query_for_visual_retrieval, visual_retrieved_segments
+
+    (
+        retreived_chunk_context,
+        (query_for_entity_retrieval, entity_retrieved_segments),
+        (query_for_visual_retrieval, visual_retrieved_segments),
+    ) = await asyncio.gather(
+        _naive_chunk_retrieval(), _entity_retrieval(), _visual_retrieval()
     )
-    segment_results = await video_segment_feature_vdb.query(query_for_visual_retrieval)
-    visual_retrieved_segments = set()
-    if len(segment_results):
-        for n in segment_results:
-            visual_retrieved_segments.add(n['__id__'])
+    if retreived_chunk_context is None:
+        return None
     
     # caption
     retrieved_segments = list(entity_retrieved_segments.union(visual_retrieved_segments))
@@ -666,45 +1085,21 @@ async def videorag_query(
             eval(x.split('_')[-1]) # index
         )
     )
-    print("LSDHJFILSDJFOISHH(FJOISDJFIOSDJFOIjsd)")
-    print(query_for_entity_retrieval)
-    print(f"Retrieved Text Segments {entity_retrieved_segments}")
-    print(query_for_visual_retrieval)
-    print(f"Retrieved Visual Segments {visual_retrieved_segments}")
-    
-    already_processed = 0
-    async def _filter_single_segment(knowledge: str, segment_key_dp: tuple[str, str]):
-        nonlocal use_model_func, already_processed
-        segment_key = segment_key_dp[0]
-        segment_content = segment_key_dp[1]
-        filter_prompt = PROMPTS["filtering_segment"]
-        filter_prompt = filter_prompt.format(caption=segment_content, knowledge=knowledge)
-        result = await use_model_func(filter_prompt)
-        already_processed += 1
-        now_ticks = PROMPTS["process_tickers"][
-            already_processed % len(PROMPTS["process_tickers"])
-        ]
-        print(
-            f"{now_ticks} Checked {already_processed} segments\r",
-            end="",
-            flush=True,
-        )
-        return (segment_key, result)
-    
+    logger.debug(f"Entity retrieval query {query_for_entity_retrieval!r}: {entity_retrieved_segments}")
+    logger.debug(f"Visual retrieval query {query_for_visual_retrieval!r}: {visual_retrieved_segments}")
+
     rough_captions = {}
     for s_id in retrieved_segments:
         video_name = '_'.join(s_id.split('_')[:-1])
         index = s_id.split('_')[-1]
         rough_captions[s_id] = video_segments._data[video_name][index]["content"]
-    results = await asyncio.gather(
-        *[_filter_single_segment(query, (s_id, rough_captions[s_id])) for s_id in rough_captions]
-    )
-    remain_segments = [x[0] for x in results if 'yes' in x[1].lower()]
-    print(f"{len(remain_segments)} Video Segments remain after filtering")
+    with stage("query.segment_filter", segments=len(rough_captions)) as stage_span:
+        remain_segments = await _filter_segments(query, rough_captions, global_config)
+        stage_span.set(kept=len(remain_segments))
+    logger.info(f"{len(remain_segments)} Video Segments remain after filtering")
     if len(remain_segments) == 0:
-        print("Since no segments remain after filtering, we utilized all the retrieved segments.")
+        logger.info("Since no segments remain after filtering, we utilized all the retrieved segments.")
         remain_segments = retrieved_segments
-    print(f"Remain segments {remain_segments}")
     
     # visual retrieval
     # keywords_for_caption = await _extract_keywords_query(
@@ -736,7 +1131,6 @@ async def videorag_query(
     text_units_context = list_of_list_to_csv(text_units_section_list)
 
     retreived_video_context = f"\n-----Retrieved Knowledge From Videos-----\n```csv\n{text_units_context}\n```\n"
-    print(f"Retreived Vid Context: \n{retreived_video_context}")
     if query_param.wo_reference:
         sys_prompt_temp = PROMPTS["videorag_response_wo_reference"]
     else:
@@ -747,12 +1141,80 @@ async def videorag_query(
         chunk_data=retreived_chunk_context,
         response_type=query_param.response_type
     )
-    with open("test.txt", "w+") as f:
-        print("************************************************************************************", file=f)
-        print(f"Query: \n{query}", file=f)
-        print("************************************************************************************", file=f)
+    return sys_prompt
+
+
+async def videorag_query(
+    query,
+    entities_vdb,
+    text_chunks_db,
+    chunks_vdb,
+    video_path_db,
+    video_segments,
+    video_segment_feature_vdb,
+    knowledge_graph_inst,
+    query_param: QueryParam,
+    global_config: dict,
+) -> str:
+    with trace("videorag_query", query_chars=len(query)), stage("query"):
+        sys_prompt = await _build_videorag_system_prompt(
+            query,
+            entities_vdb,
+            text_chunks_db,
+            chunks_vdb,
+            video_path_db,
+            video_segments,
+            video_segment_feature_vdb,
+            knowledge_graph_inst,
+            query_param,
+            global_config,
+        )
+        if sys_prompt is None:
+            return PROMPTS["fail_response"]
+        use_model_func = global_config["best_model_func"]
+        with stage("query.generate", system_prompt_chars=len(sys_prompt)):
+            response = await use_model_func(
+                query,
+                system_prompt=sys_prompt,
+            )
+        return response
+
+
+async def videorag_query_stream(
+    query,
+    entities_vdb,
+    text_chunks_db,
+    chunks_vdb,
+    video_path_db,
+    video_segments,
+    video_segment_feature_vdb,
+    knowledge_graph_inst,
+    query_param: QueryParam,
+    global_config: dict,
+):
+    """Same as ``videorag_query`` but yields the final answer as it is generated."""
+    # only retrieval is traced and timed: the context vars can't be held across yields to the consumer
+    with trace("videorag_query_stream", query_chars=len(query)), stage("query"):
+        sys_prompt = await _build_videorag_system_prompt(
+            query,
+            entities_vdb,
+            text_chunks_db,
+            chunks_vdb,
+            video_path_db,
+            video_segments,
+            video_segment_feature_vdb,
+            knowledge_graph_inst,
+            query_param,
+            global_config,
+        )
+    if sys_prompt is None:
+        yield PROMPTS["fail_response"]
+        return
+    use_model_func = global_config["best_model_func"]
     response = await use_model_func(
         query,
         system_prompt=sys_prompt,
+        stream=True,
     )
-    return response
+    async for part in response:
+        yield part
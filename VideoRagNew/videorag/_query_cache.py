@@ -0,0 +1,82 @@
+import re
+import threading
+from dataclasses import asdict
+from collections import OrderedDict
+
+import numpy as np
+
+from ._utils import compute_args_hash, logger
+
+
+def normalize_query(query: str) -> str:
+    # "How do I do the worm?" and "how do i do the worm" share an entry
+    return " ".join(re.sub(r"[^\w\s]", " ", query.lower()).split())
+
+
+class QueryCache:
+    """LRU cache of final query responses.
+
+    Entries are keyed by the normalized query, the ``QueryParam`` and an index
+    version; ``invalidate()`` bumps the version and drops everything, so any
+    insert makes earlier answers unreachable. With ``similarity_threshold`` set,
+    a miss falls back to the most similar cached query (cosine similarity of
+    ``embedding_func`` vectors) under the same param and index version.
+    """
+
+    def __init__(self, max_entries: int = 256, similarity_threshold: float = None, embedding_func=None):
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.embedding_func = embedding_func
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def _scope(self, param, index_signature) -> str:
+        return compute_args_hash(asdict(param), self.generation, index_signature)
+
+    async def _embed(self, normalized: str):
+        if self.similarity_threshold is None or self.embedding_func is None:
+            return None
+        embedding = (await self.embedding_func([normalized]))[0]
+        return embedding / np.linalg.norm(embedding)
+
+    async def get(self, query: str, param, index_signature=None):
+        normalized = normalize_query(query)
+        scope = self._scope(param, index_signature)
+        with self._lock:
+            entry = self._entries.get((scope, normalized))
+            if entry is not None:
+                self._entries.move_to_end((scope, normalized))
+                return entry["response"]
+        embedding = await self._embed(normalized)
+        if embedding is None:
+            return None
+        with self._lock:
+            candidates = [
+                (float(entry["embedding"] @ embedding), key)
+                for key, entry in self._entries.items()
+                if key[0] == scope and entry["embedding"] is not None
+            ]
+            if not candidates:
+                return None
+            similarity, key = max(candidates)
+            if similarity < self.similarity_threshold:
+                return None
+            logger.info(f"Query cache similarity hit ({similarity:.3f}): {key[1]!r}")
+            self._entries.move_to_end(key)
+            return self._entries[key]["response"]
+
+    async def put(self, query: str, param, response: str, index_signature=None):
+        normalized = normalize_query(query)
+        scope = self._scope(param, index_signature)
+        embedding = await self._embed(normalized)
+        with self._lock:
+            self._entries[(scope, normalized)] = {"response": response, "embedding": embedding}
+            self._entries.move_to_end((scope, normalized))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
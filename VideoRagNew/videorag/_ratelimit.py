@@ -0,0 +1,147 @@
+import time
+import random
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+
+from ._utils import logger
+
+# Defaults are conservative; use configure_rate_limit() to match your account tier.
+PROVIDER_RATE_LIMITS = {
+    "openai": dict(requests_per_minute=500, tokens_per_minute=200_000, max_concurrency=32),
+    "azure": dict(requests_per_minute=300, tokens_per_minute=150_000, max_concurrency=16),
+    "gemini": dict(requests_per_minute=2_000, tokens_per_minute=4_000_000, max_concurrency=32),
+}
+
+
+def estimate_tokens(texts) -> int:
+    # ~4 characters per token; good enough for admission control and cheaper than tiktoken
+    return sum(len(t) for t in texts) // 4 + 1
+
+
+class AdaptiveRateLimiter:
+    """Token buckets for requests/min and tokens/min plus an AIMD concurrency window.
+
+    Every success grows the window by ~1 per window's worth of calls, a 429
+    halves it and pauses all callers for the server's ``Retry-After``.
+    State is guarded by a thread lock so one limiter can serve several event loops.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        max_concurrency: int,
+        min_concurrency: int = 1,
+    ):
+        self.name = name
+        self.request_rate = requests_per_minute / 60
+        self.token_rate = tokens_per_minute / 60
+        self.request_capacity = float(requests_per_minute)
+        self.token_capacity = float(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(max_concurrency)
+        self._requests = self.request_capacity
+        self._tokens = self.token_capacity
+        self._in_flight = 0
+        self._blocked_until = 0.0
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._requests = min(self.request_capacity, self._requests + elapsed * self.request_rate)
+        self._tokens = min(self.token_capacity, self._tokens + elapsed * self.token_rate)
+
+    def _try_acquire(self, cost: int) -> float:
+        """Take a slot and return 0, or return how long to wait before retrying."""
+        cost = min(cost, self.token_capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            if self._in_flight >= int(self.concurrency):
+                return 0.05
+            if self._requests < 1:
+                return (1 - self._requests) / self.request_rate
+            if self._tokens < cost:
+                return (cost - self._tokens) / self.token_rate
+            self._requests -= 1
+            self._tokens -= cost
+            self._in_flight += 1
+            return 0
+
+    def _release(self, estimated: int, used: int = None, retry_after: float = None):
+        with self._lock:
+            self._in_flight -= 1
+            if used is not None:
+                self._tokens -= used - estimated
+            if retry_after is None:
+                self.concurrency = min(
+                    self.max_concurrency, self.concurrency + 1 / self.concurrency
+                )
+                return
+            self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+        logger.warning(
+            f"{self.name} rate limited, concurrency -> {int(self.concurrency)}, "
+            f"pausing {retry_after:.1f}s"
+        )
+
+    @asynccontextmanager
+    async def limit(self, estimated_tokens: int):
+        while (wait := self._try_acquire(estimated_tokens)) > 0:
+            # jitter so paused callers don't wake up in lockstep
+            await asyncio.sleep(wait * (1 + random.random() * 0.1))
+        usage = _Usage()
+        try:
+            yield usage
+        except BaseException as e:
+            retry_after = _rate_limit_retry_after(e)
+            if retry_after is not None:
+                self._release(estimated_tokens, retry_after=retry_after)
+            else:
+                self._release(estimated_tokens, used=estimated_tokens)
+            raise
+        self._release(estimated_tokens, used=usage.tokens)
+
+
+class _Usage:
+    def __init__(self):
+        self.tokens = None
+
+
+def _rate_limit_retry_after(exc: Exception):
+    """Seconds to back off if ``exc`` is a 429, else None."""
+    response = getattr(exc, "response", None)
+    if getattr(exc, "status_code", None) != 429 and getattr(response, "status_code", None) != 429:
+        return None
+    headers = getattr(response, "headers", None) or {}
+    for header, scale in (("retry-after-ms", 1e-3), ("retry-after", 1)):
+        try:
+            return float(headers[header]) * scale
+        except (KeyError, TypeError, ValueError):
+            continue
+    return 1.0
+
+
+_limiters: dict[str, AdaptiveRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str) -> AdaptiveRateLimiter:
+    with _limiters_lock:
+        if provider not in _limiters:
+            _limiters[provider] = AdaptiveRateLimiter(provider, **PROVIDER_RATE_LIMITS[provider])
+        return _limiters[provider]
+
+
+def configure_rate_limit(provider: str, **limits):
+    """Override a provider's limits; takes effect for limiters created afterwards."""
+    PROVIDER_RATE_LIMITS[provider] = {**PROVIDER_RATE_LIMITS.get(provider, {}), **limits}
+    with _limiters_lock:
+        _limiters.pop(provider, None)
@@ -0,0 +1,285 @@
+import os
+import queue
+import secrets
+import asyncio
+import argparse
+import threading
+from dataclasses import asdict
+from multiprocessing.connection import Client, Listener
+
+from ._utils import logger
+from ._embedding_cache import use_working_dir_embedding_cache
+from ._fingerprint import insert_video_incremental
+from ._metrics import export_metrics_json, export_metrics_prometheus
+from ._op import videorag_query_stream
+from ._query_cache import QueryCache
+from ._tokenizer import get_tiktoken_encoder
+from .base import QueryParam
+from .videorag import VideoRAG
+
+DEFAULT_ADDRESS = ("127.0.0.1", 8765)
+# Connections exchange pickles, so the key is what stands between a local
+# process and code execution in the service: never fall back to a fixed one.
+AUTHKEY_FILE = os.getenv(
+    "VIDEORAG_SERVICE_AUTHKEY_FILE", os.path.expanduser("~/.videorag_service_key")
+)
+
+
+def load_authkey(create: bool = False) -> bytes:
+    """Key from VIDEORAG_SERVICE_AUTHKEY, else from AUTHKEY_FILE (written 0600 when ``create``)."""
+    if os.getenv("VIDEORAG_SERVICE_AUTHKEY"):
+        return os.environ["VIDEORAG_SERVICE_AUTHKEY"].encode()
+    if os.path.exists(AUTHKEY_FILE):
+        if os.stat(AUTHKEY_FILE).st_mode & 0o077:
+            raise PermissionError(f"{AUTHKEY_FILE} must only be readable by its owner (chmod 600)")
+        with open(AUTHKEY_FILE, "rb") as f:
+            return f.read().strip()
+    if not create:
+        raise RuntimeError(
+            f"No service key: set VIDEORAG_SERVICE_AUTHKEY or start the service to create {AUTHKEY_FILE}"
+        )
+    authkey = secrets.token_hex(32).encode()
+    fd = os.open(AUTHKEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(authkey)
+    logger.info(f"Wrote a new service key to {AUTHKEY_FILE}")
+    return authkey
+
+
+class _ReadWriteLock:
+    """Many readers or one writer; a waiting writer blocks new readers."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        with self._cond:
+            self._cond.wait_for(lambda: not self._writer and not self._writers_waiting)
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            self._cond.wait_for(lambda: not self._writer and not self._readers)
+            self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class VideoRAGService:
+    """Keeps one VideoRAG instance, its stores and models warm for many requests.
+
+    Queries run concurrently on a resident event loop; inserts run on the
+    caller's thread and wait for running queries to finish, and new queries
+    wait for the insert, so the stores never change under a query. Responses
+    are cached until the next insert (see ``QueryCache``).
+    """
+
+    def __init__(
+        self,
+        load_caption_model: bool = False,
+        query_cache_size: int = 256,
+        query_cache_similarity_threshold: float = None,
+        **videorag_kwargs,
+    ):
+        self.rag = VideoRAG(**videorag_kwargs)
+        use_working_dir_embedding_cache(self.rag.working_dir)
+        self.query_cache = QueryCache(
+            max_entries=query_cache_size,
+            similarity_threshold=query_cache_similarity_threshold,
+            embedding_func=self.rag.embedding_func,
+        )
+        if load_caption_model:
+            self.rag.load_caption_model(debug=False)
+        # warm the shared encoder registry so the first chunking/query doesn't pay for it
+        get_tiktoken_encoder(self.rag.tiktoken_model_name)
+        self._store_lock = _ReadWriteLock()
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._loop_thread.start()
+
+    def _index_signature(self):
+        # also catches inserts made into the working dir without going through this service
+        return len(self.rag.video_segments._data), len(self.rag.text_chunks._data)
+
+    async def _aquery(self, query: str, param: QueryParam):
+        index_signature = self._index_signature()
+        response = await self.query_cache.get(query, param, index_signature)
+        if response is None:
+            response = await self.rag.aquery(query, param)
+            await self.query_cache.put(query, param, response, index_signature)
+        return response
+
+    def _submit_read(self, coro):
+        # the read lock is held until the coroutine is done, even if the caller stops waiting
+        self._store_lock.acquire_read()
+        try:
+            future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        except BaseException:
+            self._store_lock.release_read()
+            raise
+        future.add_done_callback(lambda _: self._store_lock.release_read())
+        return future
+
+    def query(self, query: str, param: QueryParam = None):
+        param = param if param is not None else QueryParam()
+        return self._submit_read(self._aquery(query, param)).result()
+
+    async def _aquery_stream(self, query: str, param: QueryParam, parts: queue.Queue):
+        try:
+            index_signature = self._index_signature()
+            response = await self.query_cache.get(query, param, index_signature)
+            if response is not None:
+                parts.put(response)
+                return
+            received = []
+            async for part in videorag_query_stream(
+                query,
+                self.rag.entities_vdb,
+                self.rag.text_chunks,
+                self.rag.chunks_vdb,
+                self.rag.video_path_db,
+                self.rag.video_segments,
+                self.rag.video_segment_feature_vdb,
+                self.rag.chunk_entity_relation_graph,
+                param,
+                asdict(self.rag),
+            ):
+                received.append(part)
+                parts.put(part)
+            # flush the LLM response cache the way rag.aquery does
+            await self.rag._query_done()
+            await self.query_cache.put(query, param, "".join(received), index_signature)
+        except Exception as e:
+            parts.put(e)
+        finally:
+            parts.put(None)
+
+    def query_stream(self, query: str, param: QueryParam = None):
+        """Yield the answer text as it is generated (e.g. for ``st.write_stream``)."""
+        param = param if param is not None else QueryParam()
+        parts = queue.Queue()
+        self._submit_read(self._aquery_stream(query, param, parts))
+        while (part := parts.get()) is not None:
+            if isinstance(part, Exception):
+                raise part
+            yield part
+
+    def insert_video(self, video_path_list: list[str]):
+        self._store_lock.acquire_write()
+        try:
+            insert_video_incremental(self.rag, video_path_list)
+        finally:
+            self.query_cache.invalidate()
+            self._store_lock.release_write()
+
+    def metrics(self, fmt: str = "json") -> str:
+        """Per-stage timings, LLM usage and cache hit rates as JSON or Prometheus text."""
+        if fmt == "prometheus":
+            return export_metrics_prometheus()
+        return export_metrics_json()
+
+
+_services: dict[str, tuple[VideoRAGService, dict]] = {}
+_services_lock = threading.Lock()
+
+
+def get_service(working_dir: str = "./videorag-workdir", **kwargs) -> VideoRAGService:
+    """In-process singleton: one service per working dir."""
+    with _services_lock:
+        if working_dir not in _services:
+            _services[working_dir] = (VideoRAGService(working_dir=working_dir, **kwargs), kwargs)
+        service, service_kwargs = _services[working_dir]
+        if kwargs != service_kwargs:
+            raise ValueError(
+                f"A service for {working_dir} already runs with {service_kwargs}, not {kwargs}"
+            )
+        return service
+
+
+_SERVICE_OPS = ("query", "insert_video", "metrics")
+
+
+def _handle_connection(service: VideoRAGService, conn):
+    with conn:
+        while True:
+            try:
+                op, args = conn.recv()
+            except EOFError:
+                return
+            try:
+                if op not in _SERVICE_OPS:
+                    raise ValueError(f"Unknown operation {op}")
+                conn.send(("ok", getattr(service, op)(*args)))
+            except Exception as e:
+                logger.exception(f"VideoRAG service failed on {op}")
+                conn.send(("error", repr(e)))
+
+
+def serve(address=DEFAULT_ADDRESS, authkey: bytes = None, **service_kwargs):
+    """Expose the singleton service on a local socket, one thread per connection."""
+    if authkey is None:
+        authkey = load_authkey(create=True)
+    service = get_service(**service_kwargs)
+    with Listener(address, authkey=authkey) as listener:
+        logger.info(f"VideoRAG service listening on {listener.address}")
+        while True:
+            conn = listener.accept()
+            threading.Thread(
+                target=_handle_connection, args=(service, conn), daemon=True
+            ).start()
+
+
+class VideoRAGClient:
+    def __init__(self, address=DEFAULT_ADDRESS, authkey: bytes = None):
+        self._conn = Client(address, authkey=authkey if authkey is not None else load_authkey())
+        self._lock = threading.Lock()
+
+    def _call(self, op: str, *args):
+        with self._lock:
+            self._conn.send((op, args))
+            status, result = self._conn.recv()
+        if status == "error":
+            raise RuntimeError(f"VideoRAG service error: {result}")
+        return result
+
+    def query(self, query: str, param: QueryParam = None):
+        return self._call("query", query, param if param is not None else QueryParam())
+
+    def insert_video(self, video_path_list: list[str]):
+        return self._call("insert_video", video_path_list)
+
+    def metrics(self, fmt: str = "json") -> str:
+        return self._call("metrics", fmt)
+
+    def close(self):
+        self._conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a resident VideoRAG service.")
+    parser.add_argument("--working-dir", default="./videorag-workdir")
+    parser.add_argument("--provider", default="gemini")
+    parser.add_argument("--host", default=DEFAULT_ADDRESS[0])
+    parser.add_argument("--port", type=int, default=DEFAULT_ADDRESS[1])
+    parser.add_argument("--load-caption-model", action="store_true")
+    args = parser.parse_args()
+    serve(
+        (args.host, args.port),
+        working_dir=args.working_dir,
+        provider_in_use=args.provider,
+        load_caption_model=args.load_caption_model,
+    )
@@ -0,0 +1,17 @@
+from functools import lru_cache
+
+import tiktoken
+
+TOKENIZER_NUM_THREADS = 16
+
+
+@lru_cache(maxsize=None)
+def get_tiktoken_encoder(model_name: str = "gpt-4o") -> tiktoken.Encoding:
+    """Process-wide encoder registry, so each model's BPE tables load once."""
+    return tiktoken.encoding_for_model(model_name)
+
+
+@lru_cache(maxsize=None)
+def get_tiktoken_encoding(encoding_name: str) -> tiktoken.Encoding:
+    """Same registry by encoding name, for models tiktoken has no mapping for (e.g. embeddings)."""
+    return tiktoken.get_encoding(encoding_name)
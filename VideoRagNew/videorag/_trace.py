@@ -0,0 +1,119 @@
+import os
+import json
+import random
+import logging
+import contextvars
+from time import perf_counter
+
+# Fraction of traces that are recorded; 0 turns tracing off entirely.
+TRACE_SAMPLE_RATE = float(os.getenv("VIDEORAG_TRACE_SAMPLE_RATE", "0"))
+
+trace_logger = logging.getLogger("videorag.trace")
+
+_current_trace = contextvars.ContextVar("videorag_trace", default=None)
+_current_span = contextvars.ContextVar("videorag_span", default=None)
+
+
+def _log_trace(trace_dict: dict):
+    trace_logger.info(json.dumps(trace_dict))
+
+
+_trace_sink = _log_trace
+
+
+def set_trace_sink(sink):
+    """Send finished traces (plain dicts) to ``sink`` instead of the videorag.trace logger."""
+    global _trace_sink
+    _trace_sink = sink
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("trace", "name", "attrs", "parent", "start", "duration", "_token")
+
+    def __init__(self, trace, name: str, attrs: dict, parent):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+        self.parent = parent
+        self.start = None
+        self.duration = None
+
+    def __enter__(self):
+        self.start = perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = perf_counter() - self.start
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.attrs["error"] = repr(exc)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self, origin: float) -> dict:
+        return {
+            "name": self.name,
+            "parent": self.parent.name if self.parent is not None else None,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            **self.attrs,
+        }
+
+
+class _Trace(_Span):
+    __slots__ = ("spans", "_trace_token")
+
+    def __init__(self, name: str, attrs: dict):
+        super().__init__(self, name, attrs, None)
+        self.spans = []
+
+    def __enter__(self):
+        self._trace_token = _current_trace.set(self)
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        _current_trace.reset(self._trace_token)
+        _trace_sink(
+            {
+                "trace": self.name,
+                "duration_ms": round(self.duration * 1000, 3),
+                **self.attrs,
+                "spans": [s.to_dict(self.start) for s in self.spans],
+            }
+        )
+        return False
+
+
+def trace(name: str, **attrs):
+    """Start a (sampled) trace; spans opened inside it, including in child tasks, are recorded."""
+    if TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE:
+        return _NOOP_SPAN
+    return _Trace(name, attrs)
+
+
+def span(name: str, **attrs):
+    """Time a stage of the current trace; a shared no-op when nothing is being traced."""
+    current = _current_trace.get()
+    if current is None:
+        return _NOOP_SPAN
+    new_span = _Span(current, name, attrs, _current_span.get())
+    current.spans.append(new_span)
+    return new_span
@@ -1,27 +1,56 @@
 import streamlit as st
 import yt_dlp
 import os
-import time
-
-def scrape_youtube_search(query, max_results=25):
-    # Use yt_dlp's internal search feature
-    search_query = f"ytsearch{max_results}:{query}"
-    with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
-        try: 
-            search_result = ydl.extract_info(search_query, download=False)
-            video_urls = [entry['webpage_url'] for entry in search_result['entries']]
-            return video_urls
-        except Exception as e:
-            st.error(f"Error searching YouTube: {e}")
-            return []
-
-def download_video(url, output_dir="videos"):
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+MAX_DOWNLOAD_WORKERS = 4
+# yt_dlp download archive: one "<extractor> <id>" line per finished video, so
+# re-running a download skips everything already in the output directory
+DOWNLOAD_MANIFEST = "downloaded.txt"
+
+SEARCH_PAGE_SIZE = 5
+SEARCH_CACHE_TTL = 60 * 60
+SEARCH_CACHE_MAX_ENTRIES = 256
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv")
+INSTRUCTIONAL_DIR = "videos"
+UPLOAD_DIR = "uploads"
+
+def normalize_query(query):
+    return " ".join(query.lower().split())
+
+@st.cache_data(ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_MAX_ENTRIES, show_spinner=False)
+def _search_page(query, page, page_size):
+    # Flat extraction only reads the search result pages instead of resolving
+    # every video, and playlist_items keeps each call to a single page
+    start = page * page_size + 1
+    end = start + page_size - 1
+    ydl_opts = {"quiet": True, "extract_flat": True, "playlist_items": f"{start}-{end}"}
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        search_result = ydl.extract_info(f"ytsearch{end}:{query}", download=False)
+    return [entry.get("webpage_url") or entry["url"] for entry in search_result["entries"]]
+
+def scrape_youtube_search(query, page=0, page_size=SEARCH_PAGE_SIZE):
+    # Results are cached per (normalized query, page); failures are not cached
+    try:
+        return _search_page(normalize_query(query), page, page_size)
+    except Exception as e:
+        st.error(f"Error searching YouTube: {e}")
+        return []
+
+def download_video(url, output_dir="videos", progress_hook=None):
+    # Runs on a worker thread, so errors are returned instead of reported with st.*
     os.makedirs(output_dir, exist_ok=True)
     ydl_opts = {
         "format": "bv*[height<=240]+ba/bv*+ba/b",
         "outtmpl": f"{output_dir}/%(title)s.%(ext)s",
         "merge_output_format": "mp4",
-        "quiet": False,
+        "quiet": True,
+        "noprogress": True,
+        "continuedl": True,
+        "download_archive": os.path.join(output_dir, DOWNLOAD_MANIFEST),
+        "progress_hooks": [progress_hook] if progress_hook is not None else [],
         "postprocessors": [
             {"key": "FFmpegVideoConvertor", "preferedformat": "mp4"},
         ],
@@ -30,7 +59,50 @@ def download_video(url, output_dir="videos"):
         try:
             ydl.download([url])
         except yt_dlp.utils.DownloadError as e:
-            st.error(f"❌ Error downloading {url}: {e}")
+            return str(e)
+    return None
+
+def download_videos(urls, output_dir="videos", max_workers=MAX_DOWNLOAD_WORKERS, on_progress=None, poll_interval=0.5):
+    # Downloads run on a bounded pool; partial ".part" files are resumed on the
+    # next run and finished videos are skipped through the download archive.
+    # on_progress is called from this (the script) thread with {url: fraction}.
+    progress = {url: 0.0 for url in urls}
+    lock = threading.Lock()
+
+    def make_hook(url):
+        def hook(d):
+            if d["status"] != "downloading":
+                return
+            total = d.get("total_bytes") or d.get("total_bytes_estimate")
+            if total:
+                with lock:
+                    progress[url] = min(d.get("downloaded_bytes", 0) / total, 0.99)
+        return hook
+
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(download_video, url, output_dir, make_hook(url)): url
+            for url in urls
+        }
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = futures[future]
+                try:
+                    error = future.result()
+                except Exception as e:
+                    error = str(e)
+                if error:
+                    errors[url] = error
+                with lock:
+                    progress[url] = 1.0
+            if on_progress is not None:
+                with lock:
+                    snapshot = dict(progress)
+                on_progress(snapshot)
+    return errors
 
 def show_activity_analysis_ui():
     st.header("Activity Performance Analysis")
@@ -45,28 +117,75 @@ def show_activity_analysis_ui():
         if not uploaded_file:
             st.warning("Please upload a video before analyzing.")
         else:
-            with st.spinner("Analyzing performance..."):
-                time.sleep(3)
+            # imported here so the How-To tab works without the torch/ImageBind stack
+            try:
+                from VideoRag.videorag import QueryParam
+                from VideoRag.videorag._service import get_service
+            except ImportError as e:
+                st.error(f"Performance analysis is unavailable: {e}")
+                return
+
+            os.makedirs(UPLOAD_DIR, exist_ok=True)
+            user_video = os.path.join(UPLOAD_DIR, uploaded_file.name)
+            with open(user_video, "wb") as f:
+                f.write(uploaded_file.getbuffer())
+            instructional_videos = [
+                os.path.join(INSTRUCTIONAL_DIR, f)
+                for f in os.listdir(INSTRUCTIONAL_DIR)
+                if f.lower().endswith(VIDEO_EXTENSIONS)
+            ] if os.path.isdir(INSTRUCTIONAL_DIR) else []
+            videorag = get_service(provider_in_use="gemini", working_dir="./videorag-workdir")
+            with st.spinner("Indexing videos..."):
+                videorag.insert_video(instructional_videos + [user_video])
+            # the answer is shown as it is generated instead of after the whole reply
+            query = f"Analyze my {chosen_activity} and provide feedback that is helpful and direct."
+            st.write_stream(videorag.query_stream(query, QueryParam(mode="videorag")))
             st.success("Analysis complete!")
 
+def load_more_search_results():
+    st.session_state["search_pages"] += 1
+
 def show_howto_ui():
     st.header("Find How-To Videos")
     user_query = st.text_input("Enter the task you want to learn:")
     if st.button("Search How-To Videos"):
         if user_query:
+            st.session_state["search_query"] = user_query
+            st.session_state["search_pages"] = 1
+
+    if st.session_state.get("search_query"):
+        st.write("### Found Videos:")
+        video_links = []
+        exhausted = False
+        # Pages are rendered as they arrive, so the first results show up
+        # before later pages have been fetched
+        for page in range(st.session_state["search_pages"]):
             with st.spinner("Searching YouTube..."):
-                video_links = scrape_youtube_search(user_query)
-            st.write("### Found Videos:")
-            for link in video_links:
+                page_links = scrape_youtube_search(st.session_state["search_query"], page=page)
+            for link in page_links:
                 st.write(link)
-            st.session_state["video_links"] = video_links
-            st.session_state["download_ready"] = True
+            video_links.extend(page_links)
+            if len(page_links) < SEARCH_PAGE_SIZE:
+                exhausted = True
+                break
+        if not exhausted:
+            st.button("Load more", on_click=load_more_search_results)
+        st.session_state["video_links"] = video_links
+        st.session_state["download_ready"] = True
 
     if st.session_state.get("download_ready", False):
         if st.button("Download Videos"):
+            links = st.session_state["video_links"]
+            bars = {link: st.progress(0.0, text=link) for link in links}
+
+            def render_progress(progress):
+                for link, fraction in progress.items():
+                    bars[link].progress(fraction, text=link)
+
             with st.spinner("Downloading videos..."):
-                for link in st.session_state["video_links"]:
-                    download_video(link)
+                errors = download_videos(links, on_progress=render_progress)
+            for link, error in errors.items():
+                st.error(f"❌ Error downloading {link}: {error}")
             st.success("All videos downloaded successfully (or skipped if unavailable).")
 
 def main():